@@ -3,30 +3,58 @@ Auto-Progression Engine (APE) - Experiment 2
 AI-powered workout progression tracking and recommendations.
 """
 
-import sys
 from pathlib import Path
 from datetime import datetime, timedelta
-from typing import List, Dict, Any, Optional
-
-# Add parent directory to path for imports
-sys.path.append(str(Path(__file__).parent.parent.parent))
+from typing import List, Dict, Any, Optional, Literal, Annotated
 
 from fastapi import FastAPI, Request, HTTPException
-from fastapi.templating import Jinja2Templates
-from fastapi.responses import HTMLResponse
-from pydantic import BaseModel, Field, validator
+from fastapi.responses import HTMLResponse, ORJSONResponse
+from pydantic import BaseModel, Field, field_validator
 import json
-from shared.gemini_client import gemini_client
+import re
+import numpy as np
+import orjson
+from shared.gemini_client import get_gemini_client
 from shared.config import config
+from shared.validators import CaseInsensitive
+from shared.templating import create_templates, stream_template
+from shared.fast_stats import compute_stats, session_volumes
+from shared.cache import TTLCache
+from shared.responses import conditional_response, make_etag
 
 app = FastAPI(
     title="Auto-Progression Engine (APE)",
     description="AI-powered workout progression tracking and recommendations",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
 )
 
 # Set up templates
-templates = Jinja2Templates(directory=str(Path(__file__).parent / "templates"))
+templates = create_templates(Path(__file__).parent / "templates")
+
+# Column layout for workout history arrays
+HISTORY_DTYPE = np.dtype([
+    ("weight", np.float64),
+    ("sets", np.int64),
+    ("reps", np.int64),
+    ("rpe", np.int64)
+])
+
+# Matches a leading ```json / ``` fence and a trailing ``` fence
+_FENCE_RE = re.compile(r'\A\s*```(?:json)?\n?|\n?```\s*\Z')
+
+# The demo input is fixed, so its rendered page is cached with its ETag
+demo_cache = TTLCache(maxsize=1)
+
+# Served when Gemini's reply cannot be parsed
+FALLBACK_TIPS = (
+    "Focus on maintaining good form",
+    "Monitor RPE carefully",
+    "Progressive overload should be gradual"
+)
+
+
+TrainingGoal = Annotated[Literal['strength', 'hypertrophy', 'endurance'], CaseInsensitive]
 
 
 class WorkoutEntry(BaseModel):
@@ -37,10 +65,11 @@ class WorkoutEntry(BaseModel):
     sets: int = Field(..., ge=1, le=10, description="Number of sets")
     reps: int = Field(..., ge=1, le=50, description="Number of reps")
     rpe: int = Field(..., ge=1, le=10, description="Rate of Perceived Exertion (1-10)")
-    date: Optional[str] = Field(default=None, description="Date of workout (YYYY-MM-DD)")
+    date: Optional[str] = Field(default=None, validate_default=True, description="Date of workout (YYYY-MM-DD)")
     notes: Optional[str] = Field(default=None, description="Additional notes")
     
-    @validator('date', pre=True, always=True)
+    @field_validator('date', mode='before')
+    @classmethod
     def set_default_date(cls, v):
         if v is None:
             return datetime.now().strftime("%Y-%m-%d")
@@ -51,15 +80,8 @@ class ProgressionInput(BaseModel):
     """Input schema for progression analysis."""
     
     exercise: str = Field(..., description="Exercise to analyze")
-    history: List[WorkoutEntry] = Field(..., min_items=2, description="Workout history (minimum 2 entries)")
-    goal: str = Field(default="strength", description="Training goal: strength, hypertrophy, or endurance")
-    
-    @validator('goal')
-    def validate_goal(cls, v):
-        allowed = ['strength', 'hypertrophy', 'endurance']
-        if v.lower() not in allowed:
-            raise ValueError(f'goal must be one of: {", ".join(allowed)}')
-        return v.lower()
+    history: List[WorkoutEntry] = Field(..., min_length=2, description="Workout history (minimum 2 entries)")
+    goal: TrainingGoal = Field(default="strength", description="Training goal: strength, hypertrophy, or endurance")
 
 
 class ProgressionRecommendation(BaseModel):
@@ -74,6 +96,14 @@ class ProgressionRecommendation(BaseModel):
     tips: List[str]
 
 
+class ProgressionAnalysisResponse(BaseModel):
+    """JSON envelope for the progression analysis API."""
+    
+    status: str
+    input: ProgressionInput
+    recommendation: Dict[str, Any]
+
+
 @app.get("/", response_class=HTMLResponse)
 async def home(request: Request):
     """Home page with workout logging form."""
@@ -87,41 +117,35 @@ async def home(request: Request):
 async def demo(request: Request):
     """Demo endpoint with pre-filled progression example."""
     
-    # Demo workout history
-    demo_data = ProgressionInput(
-        exercise="Barbell Squat",
-        history=[
-            WorkoutEntry(exercise="Barbell Squat", weight=60, sets=3, reps=10, rpe=7, 
-                        date="2024-12-01", notes="Felt strong"),
-            WorkoutEntry(exercise="Barbell Squat", weight=62.5, sets=3, reps=10, rpe=7, 
-                        date="2024-12-04", notes="Good form"),
-            WorkoutEntry(exercise="Barbell Squat", weight=65, sets=3, reps=9, rpe=8, 
-                        date="2024-12-07", notes="Slight struggle on last set"),
-            WorkoutEntry(exercise="Barbell Squat", weight=65, sets=3, reps=10, rpe=7, 
-                        date="2024-12-11", notes="Better than last time"),
-            WorkoutEntry(exercise="Barbell Squat", weight=67.5, sets=3, reps=10, rpe=8, 
-                        date="2024-12-14", notes="Ready for more"),
-        ],
-        goal="strength"
-    )
-    
-    # Generate progression recommendation
-    recommendation = await analyze_progression(demo_data)
-    
-    # Prepare chart data
-    chart_data = prepare_chart_data(demo_data.history)
-    
-    return templates.TemplateResponse(
-        "progression_dashboard.html",
-        {
+    page = demo_cache.get("demo")
+    if page is None:
+        demo_data = build_demo_input()
+        
+        # Project the history into columnar arrays once per request
+        arrays = to_arrays(demo_data.history)
+        
+        # Generate progression recommendation
+        recommendation = await analyze_progression(demo_data, arrays)
+        
+        # Prepare chart data
+        chart_data = prepare_chart_data(demo_data.history, arrays)
+        
+        body = templates.get_template("progression_dashboard.html").render({
             "request": request,
             "exercise": demo_data.exercise,
             "goal": demo_data.goal,
             "history": demo_data.history,
             "recommendation": recommendation,
             "chart_data": chart_data
-        }
-    )
+        }).encode()
+        page = (body, make_etag(body))
+        
+        # Don't pin a parse-error fallback for the cache's lifetime
+        if not recommendation.get("fallback"):
+            demo_cache.set("demo", page)
+    
+    body, etag = page
+    return conditional_response(request, body, "text/html; charset=utf-8", config.DEMO_MAX_AGE, etag)
 
 
 @app.post("/analyze", response_class=HTMLResponse)
@@ -133,14 +157,18 @@ async def analyze_progression_endpoint(request: Request, progression_input: Prog
     """
     
     try:
+        # Project the history into columnar arrays once per request
+        arrays = to_arrays(progression_input.history)
+        
         # Generate progression recommendation
-        recommendation = await analyze_progression(progression_input)
+        recommendation = await analyze_progression(progression_input, arrays)
         
         # Prepare chart data
-        chart_data = prepare_chart_data(progression_input.history)
+        chart_data = prepare_chart_data(progression_input.history, arrays)
         
         # Return rendered HTML template
-        return templates.TemplateResponse(
+        return stream_template(
+            templates,
             "progression_dashboard.html",
             {
                 "request": request,
@@ -156,7 +184,7 @@ async def analyze_progression_endpoint(request: Request, progression_input: Prog
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.post("/analyze-json")
+@app.post("/analyze-json", response_model=ProgressionAnalysisResponse)
 async def analyze_progression_json(progression_input: ProgressionInput):
     """
     Analyze workout progression and return as JSON.
@@ -167,48 +195,83 @@ async def analyze_progression_json(progression_input: ProgressionInput):
     try:
         recommendation = await analyze_progression(progression_input)
         
-        return {
-            "status": "success",
-            "input": progression_input.dict(),
-            "recommendation": recommendation
-        }
+        return ProgressionAnalysisResponse(
+            status="success",
+            input=progression_input,
+            recommendation=recommendation
+        )
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+# The health payload never changes, so it is encoded once with its ETag
+HEALTH_BODY = orjson.dumps({
+    "status": "healthy",
+    "experiment": "Auto-Progression Engine (APE)",
+    "version": "1.0.0"
+})
+HEALTH_ETAG = make_etag(HEALTH_BODY)
+
+
 @app.get("/health")
-async def health_check():
+async def health_check(request: Request):
     """Health check endpoint."""
+    return conditional_response(request, HEALTH_BODY, "application/json", config.HEALTH_MAX_AGE, HEALTH_ETAG)
+
+
+def to_arrays(history: List[WorkoutEntry]) -> Dict[str, np.ndarray]:
+    """
+    Project a workout history into columnar NumPy arrays.
+    
+    Args:
+        history: List of workout entries
+        
+    Returns:
+        Dictionary of weights, sets, reps and rpes arrays
+    """
+    
+    # Build a structured array in a single pass over the entries
+    records = np.array(
+        [(entry.weight, entry.sets, entry.reps, entry.rpe) for entry in history],
+        dtype=HISTORY_DTYPE
+    )
+    
     return {
-        "status": "healthy",
-        "experiment": "Auto-Progression Engine (APE)",
-        "version": "1.0.0"
+        "weights": records["weight"],
+        "sets": records["sets"],
+        "reps": records["reps"],
+        "rpes": records["rpe"]
     }
 
 
-async def analyze_progression(progression_input: ProgressionInput) -> Dict[str, Any]:
+async def analyze_progression(
+    progression_input: ProgressionInput,
+    arrays: Optional[Dict[str, np.ndarray]] = None
+) -> Dict[str, Any]:
     """
     Analyze workout history and generate progression recommendations using Gemini.
     
     Args:
         progression_input: Workout history and analysis parameters
+        arrays: Precomputed output of to_arrays, if available
         
     Returns:
-        Dictionary containing progression recommendations
+        Dictionary containing progression recommendations; "fallback" is True
+        when Gemini's reply could not be parsed
     """
     
     # Prepare history summary for Gemini
-    history_summary = "\n".join([
+    history_summary = "\n".join(
         f"- {entry.date}: {entry.sets}x{entry.reps} @ {entry.weight}kg, RPE {entry.rpe}"
         for entry in progression_input.history
-    ])
+    )
     
     # Calculate basic stats
     latest = progression_input.history[-1]
-    earliest = progression_input.history[0]
-    weight_increase = latest.weight - earliest.weight
-    avg_rpe = sum(entry.rpe for entry in progression_input.history) / len(progression_input.history)
+    if arrays is None:
+        arrays = to_arrays(progression_input.history)
+    avg_rpe, weight_increase = compute_stats(arrays["weights"], arrays["rpes"])
     
     prompt = f"""You are an expert strength coach analyzing workout progression data.
 
@@ -267,20 +330,12 @@ Return your response in this JSON format:
 """
     
     try:
-        response = await gemini_client.generate_text(prompt)
+        response = await get_gemini_client().generate_text(prompt)
         
-        # Extract JSON from response
-        response_text = response.strip()
+        # Extract JSON from response, removing markdown code blocks if present
+        response_text = _FENCE_RE.sub('', response.strip())
         
-        # Remove markdown code blocks if present
-        if response_text.startswith("```json"):
-            response_text = response_text[7:]
-        if response_text.startswith("```"):
-            response_text = response_text[3:]
-        if response_text.endswith("```"):
-            response_text = response_text[:-3]
-        
-        recommendation = json.loads(response_text.strip())
+        recommendation = orjson.loads(response_text)
         return recommendation
         
     except json.JSONDecodeError as e:
@@ -304,37 +359,59 @@ Return your response in this JSON format:
             "progression_rate": "moderate",
             "rationale": f"Conservative progression based on recent performance (parsing error: {str(e)})",
             "deload_suggested": False,
-            "tips": [
-                "Focus on maintaining good form",
-                "Monitor RPE carefully",
-                "Progressive overload should be gradual"
-            ]
+            "tips": list(FALLBACK_TIPS),
+            "fallback": True
         }
     except Exception as e:
         raise Exception(f"Error analyzing progression: {str(e)}")
 
 
-def prepare_chart_data(history: List[WorkoutEntry]) -> Dict[str, List]:
+def build_demo_input() -> ProgressionInput:
+    """Build the pre-filled progression example used by /demo."""
+    
+    # Hard-coded and known-valid, so skip validation (floats written as floats)
+    return ProgressionInput.model_construct(
+        exercise="Barbell Squat",
+        history=[
+            WorkoutEntry.model_construct(exercise="Barbell Squat", weight=60.0, sets=3, reps=10, rpe=7, 
+                        date="2024-12-01", notes="Felt strong"),
+            WorkoutEntry.model_construct(exercise="Barbell Squat", weight=62.5, sets=3, reps=10, rpe=7, 
+                        date="2024-12-04", notes="Good form"),
+            WorkoutEntry.model_construct(exercise="Barbell Squat", weight=65.0, sets=3, reps=9, rpe=8, 
+                        date="2024-12-07", notes="Slight struggle on last set"),
+            WorkoutEntry.model_construct(exercise="Barbell Squat", weight=65.0, sets=3, reps=10, rpe=7, 
+                        date="2024-12-11", notes="Better than last time"),
+            WorkoutEntry.model_construct(exercise="Barbell Squat", weight=67.5, sets=3, reps=10, rpe=8, 
+                        date="2024-12-14", notes="Ready for more"),
+        ],
+        goal="strength"
+    )
+
+
+def prepare_chart_data(
+    history: List[WorkoutEntry],
+    arrays: Optional[Dict[str, np.ndarray]] = None
+) -> Dict[str, List]:
     """
     Prepare data for charts in the dashboard.
     
     Args:
         history: List of workout entries
+        arrays: Precomputed output of to_arrays, if available
         
     Returns:
         Dictionary with chart data arrays
     """
     
-    dates = [entry.date for entry in history]
-    weights = [entry.weight for entry in history]
-    rpes = [entry.rpe for entry in history]
-    volumes = [entry.sets * entry.reps * entry.weight for entry in history]
+    if arrays is None:
+        arrays = to_arrays(history)
+    weights = arrays["weights"]
     
     return {
-        "dates": dates,
-        "weights": weights,
-        "rpes": rpes,
-        "volumes": volumes
+        "dates": [entry.date for entry in history],
+        "weights": weights.tolist(),
+        "rpes": arrays["rpes"].tolist(),
+        "volumes": session_volumes(weights, arrays["sets"], arrays["reps"]).tolist()
     }
 
 
@@ -3,20 +3,22 @@ Cognitive Bias Antidote Engine - Experiment 4
 Detects cognitive distortions in fitness thoughts and provides evidence-based reframes.
 """
 
-import sys
 from pathlib import Path
 
-# Add parent directory to path for imports
-sys.path.append(str(Path(__file__).parent.parent.parent))
-
 from fastapi import FastAPI, Request, HTTPException, Form
-from fastapi.templating import Jinja2Templates
 from fastapi.responses import HTMLResponse
 from pydantic import BaseModel, Field
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Tuple
 import json
+import re
+import numpy as np
+import orjson
 import google.generativeai as genai
 from shared.config import config
+from shared.templating import create_templates, stream_template
+from shared.cache import TTLCache
+from shared.throttling import generate_content
+from dataclasses import dataclass
 from datetime import datetime
 
 app = FastAPI(
@@ -26,12 +28,65 @@ app = FastAPI(
 )
 
 # Set up templates
-templates = Jinja2Templates(directory=str(Path(__file__).parent / "templates"))
+templates = create_templates(Path(__file__).parent / "templates")
 
 # Load cognitive bias data
 bias_data_path = Path(__file__).parent.parent.parent / "datasets" / "cognitive-biases.json"
-with open(bias_data_path, 'r') as f:
-    bias_database = json.load(f)
+with open(bias_data_path, 'rb') as f:
+    bias_database = orjson.loads(f.read())
+
+
+@dataclass(frozen=True, slots=True)
+class BiasProfile:
+    """Read-only cognitive bias entry from the database."""
+    
+    type: str
+    description: str
+    patterns: Tuple[str, ...]
+    reframes: Tuple[str, ...]
+    interventions: Tuple[str, ...]
+    coaching_tone: str
+
+
+# Frozen view of the database used for matching and fallbacks
+BIASES: Tuple[BiasProfile, ...] = tuple(
+    BiasProfile(
+        type=bias['type'],
+        description=bias['description'],
+        patterns=tuple(bias['patterns']),
+        reframes=tuple(bias['reframes']),
+        interventions=tuple(bias['interventions']),
+        coaching_tone=bias['coaching_tone']
+    )
+    for bias in bias_database['biases']
+)
+BIAS_TYPES: Tuple[str, ...] = tuple(bias.type for bias in BIASES)
+
+# Serialized database embedded in every Gemini prompt
+BIAS_CONTEXT_JSON = json.dumps(bias_database, indent=2)
+NO_HISTORY_CONTEXT = "No history provided"
+
+# Matches a leading ```json / ``` fence and a trailing ``` fence
+_FENCE_RE = re.compile(r'\A\s*```(?:json)?\n?|\n?```\s*\Z')
+
+# Tokenizer shared by pattern preprocessing and thought matching
+_TOKEN_RE = re.compile(r"[\w']+")
+
+# Struct-of-arrays view of the bias database, precomputed for matching
+BIAS_PATTERNS: Tuple[Tuple[str, ...], ...] = tuple(bias.patterns for bias in BIASES)
+_PATTERN_KEYWORDS = [
+    _TOKEN_RE.findall(p.lower())[:3]
+    for patterns in BIAS_PATTERNS
+    for p in patterns
+]
+
+# One row per pattern: its leading keywords (padded), a validity mask,
+# and the index of the bias it belongs to
+KW_MATRIX = np.array([keywords + [''] * (3 - len(keywords)) for keywords in _PATTERN_KEYWORDS])
+KW_MASK = KW_MATRIX != ''
+PATTERN_BIAS = np.repeat(np.arange(len(BIAS_PATTERNS)), [len(p) for p in BIAS_PATTERNS])
+PATTERN_OFFSETS = np.concatenate(([0], np.cumsum([len(p) for p in BIAS_PATTERNS])))
+PATTERNS_PER_BIAS = np.diff(PATTERN_OFFSETS)
 
 
 class ThoughtInput(BaseModel):
@@ -67,40 +122,57 @@ class BiasAnalysisResponse(BaseModel):
     secondary_biases: List[BiasDetection]
     overall_assessment: str
     recommended_action: str
-    timestamp: str
+    timestamp: str = Field(default_factory=lambda: datetime.now().isoformat())
 
 
 # Configure Gemini
-genai.configure(api_key=config.GEMINI_API_KEY)
+genai.configure(api_key=config.GEMINI_API_KEY, transport=config.GEMINI_TRANSPORT)
+model = genai.GenerativeModel(
+    model_name='gemini-2.0-flash-exp',
+    generation_config={
+        'temperature': 0.7,
+        'top_p': 0.9,
+        'top_k': 40,
+        'max_output_tokens': 2048,
+    }
+)
+
+# Cache of Gemini analyses keyed by (thought, context, serialized history)
+analysis_cache = TTLCache()
 
 
 def find_matching_biases(thought: str, context: str = None) -> List[Dict[str, Any]]:
     """
     Find cognitive biases that match the thought pattern.
     """
-    matching_biases = []
-    thought_lower = thought.lower()
+    tokens = set(_TOKEN_RE.findall(thought.lower()))
+    if not tokens:
+        return []
     
-    for bias in bias_database['biases']:
-        # Check if any patterns match the thought
-        pattern_matches = [p for p in bias['patterns'] if any(
-            keyword in thought_lower for keyword in p.lower().split()[:3]
-        )]
-        
-        if pattern_matches:
-            matching_biases.append({
-                'bias': bias,
-                'matched_patterns': pattern_matches,
-                'confidence': len(pattern_matches) / len(bias['patterns'])
-            })
+    # Score every pattern at once: a pattern matches if any keyword is in the thought
+    hits = np.isin(KW_MATRIX, np.array(list(tokens))) & KW_MASK
+    pattern_hits = hits.any(axis=1)
+    match_counts = np.bincount(PATTERN_BIAS, weights=pattern_hits, minlength=len(BIAS_PATTERNS))
+    confidences = match_counts / PATTERNS_PER_BIAS
     
     # Sort by confidence
-    matching_biases.sort(key=lambda x: x['confidence'], reverse=True)
+    matching_biases = []
+    for bias_index in np.argsort(-confidences, kind='stable'):
+        if match_counts[bias_index] == 0:
+            break
+        start = PATTERN_OFFSETS[bias_index]
+        matched = np.flatnonzero(pattern_hits[start:PATTERN_OFFSETS[bias_index + 1]])
+        patterns = BIAS_PATTERNS[bias_index]
+        matching_biases.append({
+            'bias': BIASES[bias_index],
+            'matched_patterns': [patterns[i] for i in matched],
+            'confidence': float(confidences[bias_index])
+        })
     
     return matching_biases
 
 
-def generate_bias_analysis(thought: str, context: str = None, user_history: Dict = None) -> BiasAnalysisResponse:
+async def generate_bias_analysis(thought: str, context: str = None, user_history: Dict = None) -> BiasAnalysisResponse:
     """
     Use Gemini to perform deep cognitive bias analysis.
     """
@@ -109,8 +181,13 @@ def generate_bias_analysis(thought: str, context: str = None, user_history: Dict
     potential_biases = find_matching_biases(thought, context)
     
     # Prepare context for Gemini
-    bias_context = json.dumps(bias_database, indent=2)
-    user_context = json.dumps(user_history, indent=2) if user_history else "No history provided"
+    user_context = json.dumps(user_history, indent=2) if user_history else NO_HISTORY_CONTEXT
+    
+    # Serve repeated thoughts from cache instead of calling Gemini again
+    cache_key = (thought, context, user_context)
+    cached = analysis_cache.get(cache_key)
+    if cached is not None:
+        return cached.model_copy(update={"timestamp": datetime.now().isoformat()})
     
     prompt = f"""You are an expert fitness psychology coach specializing in cognitive behavioral therapy (CBT) for athletes and fitness enthusiasts.
 
@@ -121,7 +198,7 @@ CONTEXT: {context or "No additional context"}
 USER HISTORY: {user_context}
 
 AVAILABLE COGNITIVE BIASES DATABASE:
-{bias_context}
+{BIAS_CONTEXT_JSON}
 
 INSTRUCTIONS:
 1. Identify the PRIMARY cognitive bias present in this thought (the most dominant one)
@@ -168,30 +245,12 @@ FORMAT YOUR RESPONSE AS JSON:
 """
 
     try:
-        model = genai.GenerativeModel(
-            model_name='gemini-2.0-flash-exp',
-            generation_config={
-                'temperature': 0.7,
-                'top_p': 0.9,
-                'top_k': 40,
-                'max_output_tokens': 2048,
-            }
-        )
-        
-        response = model.generate_content(prompt)
-        
-        # Extract JSON from response
-        response_text = response.text.strip()
+        response = await generate_content(model, prompt)
         
-        # Remove markdown code blocks if present
-        if response_text.startswith('```json'):
-            response_text = response_text[7:]
-        if response_text.startswith('```'):
-            response_text = response_text[3:]
-        if response_text.endswith('```'):
-            response_text = response_text[:-3]
+        # Extract JSON from response, removing markdown code blocks if present
+        response_text = _FENCE_RE.sub('', response.text.strip())
         
-        analysis_data = json.loads(response_text.strip())
+        analysis_data = orjson.loads(response_text)
         
         # Build BiasDetection objects
         primary_bias = BiasDetection(
@@ -225,15 +284,16 @@ FORMAT YOUR RESPONSE AS JSON:
             for bias in analysis_data.get('secondary_biases', [])
         ]
         
-        return BiasAnalysisResponse(
+        analysis = BiasAnalysisResponse(
             original_thought=thought,
             context=context,
             primary_bias=primary_bias,
             secondary_biases=secondary_biases,
             overall_assessment=analysis_data['overall_assessment'],
-            recommended_action=analysis_data['recommended_action'],
-            timestamp=datetime.now().isoformat()
+            recommended_action=analysis_data['recommended_action']
         )
+        analysis_cache.set(cache_key, analysis)
+        return analysis
         
     except Exception as e:
         # Fallback to rule-based matching if Gemini fails
@@ -245,25 +305,24 @@ FORMAT YOUR RESPONSE AS JSON:
                 original_thought=thought,
                 context=context,
                 primary_bias=BiasDetection(
-                    bias_type=bias['type'],
-                    bias_description=bias['description'],
+                    bias_type=bias.type,
+                    bias_description=bias.description,
                     confidence=bias_match['confidence'],
                     original_thought=thought,
                     detected_patterns=bias_match['matched_patterns'],
-                    reframe=bias['reframes'][0],
-                    intervention=bias['interventions'][0],
+                    reframe=bias.reframes[0],
+                    intervention=bias.interventions[0],
                     intervention_details={
-                        "action": f"Try a {bias['interventions'][0]}",
+                        "action": f"Try a {bias.interventions[0]}",
                         "why": "This will help reframe your thinking"
                     },
-                    coaching_tone=bias['coaching_tone'],
+                    coaching_tone=bias.coaching_tone,
                     actionable_next_step="Take one small action toward your goal right now",
                     affirmation="You are capable of growth and progress"
                 ),
                 secondary_biases=[],
-                overall_assessment=f"This thought shows signs of {bias['type']} thinking. Remember: progress isn't perfect.",
-                recommended_action="Focus on one small action you can take right now",
-                timestamp=datetime.now().isoformat()
+                overall_assessment=f"This thought shows signs of {bias.type} thinking. Remember: progress isn't perfect.",
+                recommended_action="Focus on one small action you can take right now"
             )
         else:
             raise HTTPException(status_code=500, detail=f"Analysis failed: {str(e)}")
@@ -274,7 +333,7 @@ async def home(request: Request):
     """Home page with input form."""
     return templates.TemplateResponse("home.html", {
         "request": request,
-        "bias_types": [bias['type'] for bias in bias_database['biases']]
+        "bias_types": BIAS_TYPES
     })
 
 
@@ -283,7 +342,7 @@ async def analyze_thought(input_data: ThoughtInput):
     """
     Analyze a thought for cognitive biases and return reframes.
     """
-    analysis = generate_bias_analysis(
+    analysis = await generate_bias_analysis(
         thought=input_data.thought,
         context=input_data.context,
         user_history=input_data.user_history
@@ -301,13 +360,13 @@ async def analyze_thought_visual(
     """
     Analyze thought and return visual card output.
     """
-    analysis = generate_bias_analysis(
+    analysis = await generate_bias_analysis(
         thought=thought,
         context=context if context else None,
         user_history=None
     )
     
-    return templates.TemplateResponse("bias_card.html", {
+    return stream_template(templates, "bias_card.html", {
         "request": request,
         "analysis": analysis
     })
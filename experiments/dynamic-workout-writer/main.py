@@ -3,59 +3,96 @@ Dynamic Workout Writer (DW²) - Experiment 1
 AI-generated adaptive workouts based on daily conditions.
 """
 
-import sys
+import asyncio
+from contextlib import asynccontextmanager
 from pathlib import Path
 
-# Add parent directory to path for imports
-sys.path.append(str(Path(__file__).parent.parent.parent))
-
 from fastapi import FastAPI, Request, HTTPException
-from fastapi.templating import Jinja2Templates
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, ORJSONResponse
 from fastapi.staticfiles import StaticFiles
-from pydantic import BaseModel, Field, validator
-from typing import List, Optional
+from pydantic import BaseModel, Field
+from typing import List, Optional, Dict, Any, Literal, Annotated
 import json
-from shared.gemini_client import gemini_client
+import orjson
+from shared.gemini_client import get_gemini_client
 from shared.config import config
+from shared.validators import CaseInsensitive
+from shared.templating import create_templates
+from shared.cache import TTLCache
+from shared.responses import conditional_response, make_etag
+
+# Common requests generated at startup when WORKOUT_WARMUP is enabled
+WARMUP_INPUTS = [
+    {
+        "fitness_level": level,
+        "goals": [goal],
+        "time_available": minutes,
+        "equipment": ["bodyweight"],
+        "fatigue": 5,
+        "stress": 5,
+        "sleep_hours": 7.0
+    }
+    for level in ("beginner", "intermediate", "advanced")
+    for goal in ("strength", "cardio", "mobility")
+    for minutes in (15, 30, 45)
+]
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Warm the workout cache in the background so startup is not delayed."""
+    warmup = None
+    if config.WORKOUT_WARMUP:
+        warmup = asyncio.create_task(
+            get_gemini_client().warmup([*WARMUP_INPUTS, build_demo_input().model_dump()])
+        )
+    
+    yield
+    
+    if warmup is not None:
+        warmup.cancel()
+
 
 app = FastAPI(
     title="Dynamic Workout Writer (DW²)",
     description="AI-generated adaptive workouts based on daily conditions",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan
 )
 
 # Set up templates
-templates = Jinja2Templates(directory=str(Path(__file__).parent / "templates"))
+templates = create_templates(Path(__file__).parent / "templates")
+
+# The demo input is fixed, so its rendered page is cached with its ETag
+demo_cache = TTLCache(maxsize=1)
+
+
+FitnessLevel = Annotated[Literal['beginner', 'intermediate', 'advanced'], CaseInsensitive]
+Goal = Annotated[
+    Literal['strength', 'cardio', 'flexibility', 'mobility', 'endurance', 'power'],
+    CaseInsensitive
+]
 
 
 class WorkoutInput(BaseModel):
     """Input schema for workout generation."""
     
-    fitness_level: str = Field(..., description="Fitness level: beginner, intermediate, or advanced")
-    goals: List[str] = Field(..., description="Fitness goals: strength, cardio, flexibility, etc.")
+    fitness_level: FitnessLevel = Field(..., description="Fitness level: beginner, intermediate, or advanced")
+    goals: List[Goal] = Field(..., min_length=1, description="Fitness goals: strength, cardio, flexibility, etc.")
     time_available: int = Field(..., ge=5, le=120, description="Available time in minutes")
     equipment: List[str] = Field(default=["bodyweight"], description="Available equipment")
     fatigue: int = Field(..., ge=1, le=10, description="Current fatigue level (1-10)")
     stress: int = Field(..., ge=1, le=10, description="Current stress level (1-10)")
     sleep_hours: float = Field(..., ge=0, le=24, description="Hours of sleep last night")
+
+
+class WorkoutGenerationResponse(BaseModel):
+    """JSON envelope for the workout generation API."""
     
-    @validator('fitness_level')
-    def validate_fitness_level(cls, v):
-        allowed = ['beginner', 'intermediate', 'advanced']
-        if v.lower() not in allowed:
-            raise ValueError(f'fitness_level must be one of: {", ".join(allowed)}')
-        return v.lower()
-    
-    @validator('goals')
-    def validate_goals(cls, v):
-        if not v:
-            raise ValueError('At least one goal must be specified')
-        allowed = ['strength', 'cardio', 'flexibility', 'mobility', 'endurance', 'power']
-        for goal in v:
-            if goal.lower() not in allowed:
-                raise ValueError(f'Invalid goal: {goal}. Allowed: {", ".join(allowed)}')
-        return [g.lower() for g in v]
+    status: str
+    input: WorkoutInput
+    output: Dict[str, Any]
 
 
 @app.get("/", response_class=HTMLResponse)
@@ -71,36 +108,27 @@ async def home(request: Request):
 async def demo(request: Request):
     """Demo endpoint with pre-filled workout example."""
     
-    # Demo workout data
-    demo_input = WorkoutInput(
-        fitness_level="intermediate",
-        goals=["strength"],
-        time_available=30,
-        equipment=["dumbbells"],
-        fatigue=3,
-        stress=2,
-        sleep_hours=6
-    )
-    
-    # Generate workout
-    workout_data = await gemini_client.generate_workout(
-        fitness_level=demo_input.fitness_level,
-        goals=demo_input.goals,
-        time_available=demo_input.time_available,
-        equipment=demo_input.equipment,
-        fatigue=demo_input.fatigue,
-        stress=demo_input.stress,
-        sleep_hours=demo_input.sleep_hours
-    )
-    
-    return templates.TemplateResponse(
-        "workout_card.html",
-        {
+    page = demo_cache.get("demo")
+    if page is None:
+        demo_input = build_demo_input()
+        
+        # Generate workout
+        user_input = demo_input.model_dump()
+        workout_data = await get_gemini_client().generate_workout(**user_input)
+        
+        body = templates.get_template("workout_card.html").render({
             "request": request,
             "workout_data": workout_data,
-            "user_input": demo_input.dict()
-        }
-    )
+            "user_input": user_input
+        }).encode()
+        page = (body, make_etag(body))
+        
+        # Don't pin a parse-error fallback for the cache's lifetime
+        if not workout_data.get("fallback"):
+            demo_cache.set("demo", page)
+    
+    body, etag = page
+    return conditional_response(request, body, "text/html; charset=utf-8", config.DEMO_MAX_AGE, etag)
 
 
 @app.post("/generate", response_class=HTMLResponse)
@@ -113,15 +141,8 @@ async def generate_workout(request: Request, workout_input: WorkoutInput):
     
     try:
         # Generate workout using Gemini
-        workout_data = await gemini_client.generate_workout(
-            fitness_level=workout_input.fitness_level,
-            goals=workout_input.goals,
-            time_available=workout_input.time_available,
-            equipment=workout_input.equipment,
-            fatigue=workout_input.fatigue,
-            stress=workout_input.stress,
-            sleep_hours=workout_input.sleep_hours
-        )
+        user_input = workout_input.model_dump()
+        workout_data = await get_gemini_client().generate_workout(**user_input)
         
         # Return rendered HTML template
         return templates.TemplateResponse(
@@ -129,7 +150,7 @@ async def generate_workout(request: Request, workout_input: WorkoutInput):
             {
                 "request": request,
                 "workout_data": workout_data,
-                "user_input": workout_input.dict()
+                "user_input": user_input
             }
         )
         
@@ -137,7 +158,7 @@ async def generate_workout(request: Request, workout_input: WorkoutInput):
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.post("/generate-json")
+@app.post("/generate-json", response_model=WorkoutGenerationResponse)
 async def generate_workout_json(workout_input: WorkoutInput):
     """
     Generate an adaptive workout and return as JSON.
@@ -146,34 +167,47 @@ async def generate_workout_json(workout_input: WorkoutInput):
     """
     
     try:
-        workout_data = await gemini_client.generate_workout(
-            fitness_level=workout_input.fitness_level,
-            goals=workout_input.goals,
-            time_available=workout_input.time_available,
-            equipment=workout_input.equipment,
-            fatigue=workout_input.fatigue,
-            stress=workout_input.stress,
-            sleep_hours=workout_input.sleep_hours
-        )
+        workout_data = await get_gemini_client().generate_workout(**workout_input.model_dump())
         
-        return {
-            "status": "success",
-            "input": workout_input.dict(),
-            "output": workout_data
-        }
+        return WorkoutGenerationResponse(
+            status="success",
+            input=workout_input,
+            output=workout_data
+        )
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+def build_demo_input() -> WorkoutInput:
+    """Build the pre-filled workout example used by /demo."""
+    
+    # Hard-coded and known-valid, so skip validation (floats written as floats)
+    return WorkoutInput.model_construct(
+        fitness_level="intermediate",
+        goals=["strength"],
+        time_available=30,
+        equipment=["dumbbells"],
+        fatigue=3,
+        stress=2,
+        sleep_hours=6.0
+    )
+
+
+
+# The health payload never changes, so it is encoded once with its ETag
+HEALTH_BODY = orjson.dumps({
+    "status": "healthy",
+    "experiment": "Dynamic Workout Writer (DW²)",
+    "version": "1.0.0"
+})
+HEALTH_ETAG = make_etag(HEALTH_BODY)
+
+
 @app.get("/health")
-async def health_check():
+async def health_check(request: Request):
     """Health check endpoint."""
-    return {
-        "status": "healthy",
-        "experiment": "Dynamic Workout Writer (DW²)",
-        "version": "1.0.0"
-    }
+    return conditional_response(request, HEALTH_BODY, "application/json", config.HEALTH_MAX_AGE, HEALTH_ETAG)
 
 
 if __name__ == "__main__":
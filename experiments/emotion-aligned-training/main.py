@@ -3,51 +3,72 @@ Emotion-Aligned Training Model - Experiment 3
 Maps emotional state to ideal workout intensity & coaching tone.
 """
 
-import sys
+import logging
 from pathlib import Path
+from contextlib import aclosing
 
-# Add parent directory to path for imports
-sys.path.append(str(Path(__file__).parent.parent.parent))
-
-from fastapi import FastAPI, Request, HTTPException
-from fastapi.templating import Jinja2Templates
-from fastapi.responses import HTMLResponse
-from pydantic import BaseModel, Field, validator
-from typing import List, Optional, Dict, Any
-import json
+from fastapi import FastAPI, Request, HTTPException, Body
+from fastapi.responses import HTMLResponse, StreamingResponse, ORJSONResponse
+from pydantic import BaseModel, Field, field_validator
+from typing import List, Optional, Dict, Any, Annotated, AsyncIterator
+import orjson
 import google.generativeai as genai
 from shared.config import config
+from shared.validators import CaseInsensitive
+from shared.batching import gather_bounded
+from shared.cache import TTLCache, SingleFlight
+from shared.throttling import generate_content, stream_content
+from shared.templating import create_templates
 
 app = FastAPI(
     title="Emotion-Aligned Training Model",
     description="Maps emotional state to ideal workout intensity & coaching tone",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
 )
 
+logger = logging.getLogger(__name__)
+
 # Set up templates
-templates = Jinja2Templates(directory=str(Path(__file__).parent / "templates"))
+templates = create_templates(Path(__file__).parent / "templates")
+
+# Initialize Gemini
+config.validate()
+genai.configure(api_key=config.GEMINI_API_KEY, transport=config.GEMINI_TRANSPORT)
+model = genai.GenerativeModel(config.GEMINI_MODEL)
 
 # Load emotion mapping data
 emotion_data_path = Path(__file__).parent.parent.parent / "datasets" / "emotion-mapping.json"
-with open(emotion_data_path, 'r') as f:
-    emotion_mapping = json.load(f)
+with open(emotion_data_path, 'rb') as f:
+    emotion_mapping = orjson.loads(f.read())
+
+# Lookup tables built once from the mapping data
+MOOD_INDEX = {mapping['mood']: mapping for mapping in emotion_mapping['mappings']}
+COACHING_TONES = emotion_mapping['coaching_tones']
+INTENSITY_GUIDELINES = emotion_mapping['intensity_guidelines']
+
+# Moods offered by the home page form (in dataset order) and accepted by validation
+MOOD_OPTIONS = list(MOOD_INDEX)
+VALID_MOODS = frozenset(MOOD_OPTIONS)
+
+# Cache of AI session messages keyed by (mood, energy, stress)
+session_cache = TTLCache()
+session_flight = SingleFlight()
 
 
 class EmotionInput(BaseModel):
     """Input schema for emotion-based workout generation."""
     
-    mood: str = Field(..., description="Current emotional state/mood")
+    mood: Annotated[str, CaseInsensitive] = Field(..., description="Current emotional state/mood")
     energy: int = Field(..., ge=1, le=10, description="Current energy level (1-10)")
     stress: int = Field(..., ge=1, le=10, description="Current stress level (1-10)")
     
-    @validator('mood')
+    @field_validator('mood')
+    @classmethod
     def validate_mood(cls, v):
-        valid_moods = ['anxious', 'energetic', 'tired', 'motivated', 'frustrated', 
-                       'sad', 'overwhelmed', 'confident', 'restless', 'content', 
-                       'excited', 'neutral']
-        if v.lower() not in valid_moods:
-            raise ValueError(f'mood must be one of: {", ".join(valid_moods)}')
-        return v.lower()
+        if v not in VALID_MOODS:
+            raise ValueError(f'mood must be one of: {", ".join(MOOD_OPTIONS)}')
+        return v
 
 
 class EmotionRecommendation(BaseModel):
@@ -80,22 +101,17 @@ def get_emotion_recommendation(mood: str, energy: int, stress: int) -> Dict[str,
     """
     
     # Find matching mood mapping
-    mood_mapping = None
-    for mapping in emotion_mapping['mappings']:
-        if mapping['mood'] == mood:
-            mood_mapping = mapping
-            break
-    
-    if not mood_mapping:
+    mood_mapping = MOOD_INDEX.get(mood)
+    if mood_mapping is None:
         raise HTTPException(status_code=400, detail=f"Mood '{mood}' not found in mapping data")
     
     # Get coaching tone details
     coaching_tone = mood_mapping['coaching_tone']
-    coaching_details = emotion_mapping['coaching_tones'].get(coaching_tone, {})
+    coaching_details = COACHING_TONES.get(coaching_tone, {})
     
     # Get intensity details
     intensity = mood_mapping['recommended_intensity']
-    intensity_details = emotion_mapping['intensity_guidelines'].get(intensity, {})
+    intensity_details = INTENSITY_GUIDELINES.get(intensity, {})
     
     # Select example session
     example_sessions = mood_mapping.get('example_sessions', [])
@@ -118,22 +134,18 @@ def get_emotion_recommendation(mood: str, energy: int, stress: int) -> Dict[str,
     }
 
 
-async def generate_ai_session(recommendation: Dict[str, Any]) -> str:
+def build_session_prompt(recommendation: Dict[str, Any]) -> str:
     """
-    Use Gemini to generate a personalized session description.
+    Build the Gemini prompt for a personalized session description.
     
     Args:
         recommendation: Base recommendation data
         
     Returns:
-        AI-generated session description
+        Prompt text
     """
     
-    config.validate()
-    genai.configure(api_key=config.GEMINI_API_KEY)
-    model = genai.GenerativeModel(config.GEMINI_MODEL)
-    
-    prompt = f"""You are an empathetic fitness coach creating a personalized workout session.
+    return f"""You are an empathetic fitness coach creating a personalized workout session.
 
 User's Emotional State:
 - Mood: {recommendation['mood']}
@@ -154,32 +166,127 @@ Generate a warm, personalized 2-3 sentence session introduction that:
 
 Keep it concise and conversational. No generic fitness clichés."""
 
+
+def fallback_session_message(recommendation: Dict[str, Any]) -> str:
+    """Template-based session description used when Gemini fails."""
+    return f"Given how you're feeling {recommendation['mood']} today, this {recommendation['intensity']} intensity session is designed to meet you where you are. {recommendation['reason']}"
+
+
+async def generate_ai_session(recommendation: Dict[str, Any], use_cache: bool = True) -> str:
+    """
+    Use Gemini to generate a personalized session description.
+    
+    Args:
+        recommendation: Base recommendation data
+        use_cache: Serve a cached message for the same emotional state if available
+        
+    Returns:
+        AI-generated session description
+    """
+    
+    # The recommendation is a pure function of the emotional state
+    cache_key = (recommendation['mood'], recommendation['energy'], recommendation['stress'])
+    if use_cache:
+        cached = session_cache.get(cache_key)
+        if cached is not None:
+            return cached
+    
+    async def request_session() -> str:
+        prompt = build_session_prompt(recommendation)
+    
+        try:
+            response = await generate_content(model, prompt)
+            message = response.text.strip()
+            session_cache.set(cache_key, message)
+            return message
+        except Exception as e:
+            # Fallback to template-based message
+            return fallback_session_message(recommendation)
+    
+    # Concurrent requests for the same state share one Gemini call
+    return await session_flight.run(cache_key, request_session)
+
+
+def format_sse(data: str, event: Optional[str] = None) -> str:
+    """Encode text as a server-sent event, one data line per text line."""
+    lines = [f"event: {event}"] if event else []
+    lines.extend(f"data: {line}" for line in data.split("\n"))
+    return "\n".join(lines) + "\n\n"
+
+
+async def stream_ai_session(recommendation: Dict[str, Any]) -> AsyncIterator[str]:
+    """
+    Stream the personalized session description as server-sent events.
+    
+    Args:
+        recommendation: Base recommendation data
+        
+    Yields:
+        SSE-encoded text chunks as Gemini produces them, then a done event
+    """
+    
+    cache_key = (recommendation['mood'], recommendation['energy'], recommendation['stress'])
+    cached = session_cache.get(cache_key)
+    if cached is not None:
+        yield format_sse(cached)
+        yield format_sse("", event="done")
+        return
+    
+    prompt = build_session_prompt(recommendation)
+    
+    parts = []
     try:
-        response = model.generate_content(prompt)
-        return response.text.strip()
-    except Exception as e:
-        # Fallback to template-based message
-        return f"Given how you're feeling {recommendation['mood']} today, this {recommendation['intensity']} intensity session is designed to meet you where you are. {recommendation['reason']}"
+        async with aclosing(stream_content(model, prompt)) as stream:
+            async for text in stream:
+                parts.append(text)
+                yield format_sse(text)
+        session_cache.set(cache_key, "".join(parts).strip())
+    except Exception:
+        logger.warning("AI session stream failed after %d chunks", len(parts), exc_info=True)
+        
+        # Fall back to the template message only if nothing was sent yet
+        if not parts:
+            yield format_sse(fallback_session_message(recommendation))
+    
+    yield format_sse("", event="done")
+
+
+async def build_recommendation(emotion_input: EmotionInput, use_cache: bool = True) -> Dict[str, Any]:
+    """
+    Build a recommendation with its AI-generated message for one input.
+    
+    Args:
+        emotion_input: Validated emotional state
+        use_cache: Serve a cached AI message if available
+        
+    Returns:
+        Recommendation dictionary including ai_message
+    """
+    
+    recommendation = get_emotion_recommendation(
+        mood=emotion_input.mood,
+        energy=emotion_input.energy,
+        stress=emotion_input.stress
+    )
+    recommendation['ai_message'] = await generate_ai_session(recommendation, use_cache)
+    return recommendation
 
 
 @app.get("/", response_class=HTMLResponse)
 async def home(request: Request):
     """Home page with emotion input form."""
     
-    # Get list of valid moods for the form
-    valid_moods = [mapping['mood'] for mapping in emotion_mapping['mappings']]
-    
     return templates.TemplateResponse(
         "home.html",
         {
             "request": request,
-            "valid_moods": valid_moods
+            "valid_moods": MOOD_OPTIONS
         }
     )
 
 
 @app.post("/generate", response_class=HTMLResponse)
-async def generate_recommendation(request: Request, emotion_input: EmotionInput):
+async def generate_recommendation(request: Request, emotion_input: EmotionInput, nocache: bool = False):
     """Generate emotion-aligned workout recommendation."""
     
     # Get base recommendation
@@ -190,7 +297,7 @@ async def generate_recommendation(request: Request, emotion_input: EmotionInput)
     )
     
     # Generate AI personalization
-    ai_message = await generate_ai_session(recommendation)
+    ai_message = await generate_ai_session(recommendation, use_cache=not nocache)
     recommendation['ai_message'] = ai_message
     
     return templates.TemplateResponse(
@@ -227,24 +334,39 @@ async def demo(request: Request):
 
 
 @app.get("/api/recommendation")
-async def api_recommendation(mood: str, energy: int, stress: int):
+async def api_recommendation(mood: str, energy: int, stress: int, nocache: bool = False):
     """API endpoint returning JSON recommendation."""
     
     # Validate inputs
     emotion_input = EmotionInput(mood=mood, energy=energy, stress=stress)
     
-    # Get recommendation
+    # Get recommendation with AI message
+    return await build_recommendation(emotion_input, use_cache=not nocache)
+
+
+@app.get("/api/recommendation/stream")
+async def api_recommendation_stream(mood: str, energy: int, stress: int):
+    """API endpoint streaming the AI message as server-sent events."""
+    
+    # Validate inputs
+    emotion_input = EmotionInput(mood=mood, energy=energy, stress=stress)
+    
     recommendation = get_emotion_recommendation(
         mood=emotion_input.mood,
         energy=emotion_input.energy,
         stress=emotion_input.stress
     )
     
-    # Generate AI message
-    ai_message = await generate_ai_session(recommendation)
-    recommendation['ai_message'] = ai_message
+    return StreamingResponse(stream_ai_session(recommendation), media_type="text/event-stream")
+
+
+@app.post("/api/batch")
+async def api_batch(
+    inputs: Annotated[List[EmotionInput], Body(min_length=1, max_length=config.MAX_BATCH_SIZE)]
+):
+    """API endpoint generating several recommendations concurrently."""
     
-    return recommendation
+    return await gather_bounded(build_recommendation, inputs)
 
 
 if __name__ == "__main__":
@@ -4,38 +4,90 @@ Generates unique fitness identity cards based on user traits, goals, and prefere
 """
 
 import json
-import sys
 from pathlib import Path
-from typing import List, Optional
-from fastapi import FastAPI, Request, HTTPException, Form
-from fastapi.templating import Jinja2Templates
-from fastapi.responses import HTMLResponse
+from typing import List, Optional, Annotated
+from fastapi import FastAPI, Request, HTTPException, Form, Body, BackgroundTasks
+from fastapi.responses import HTMLResponse, ORJSONResponse
 from pydantic import BaseModel, Field
 import google.generativeai as genai
+import orjson
 
-# Add shared directory to path
-sys.path.append(str(Path(__file__).parent.parent.parent))
 from shared.config import config
+from shared.batching import gather_bounded
+from shared.cache import TTLCache, SingleFlight, hash_key
+from shared.throttling import generate_content
+from shared.templating import create_templates
+from shared.outputs import write_json
 
 # Initialize FastAPI app
 app = FastAPI(
     title="Fitness Persona Generator",
     description="Generate unique fitness identity cards using AI",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
 )
 
 # Set up templates
-templates = Jinja2Templates(directory=str(Path(__file__).parent / "templates"))
+templates = create_templates(Path(__file__).parent / "templates")
 
 # Initialize Gemini
 config.validate()
-genai.configure(api_key=config.GEMINI_API_KEY)
-model = genai.GenerativeModel(config.GEMINI_MODEL)
+genai.configure(api_key=config.GEMINI_API_KEY, transport=config.GEMINI_TRANSPORT)
 
 # Load persona archetypes
 personas_file = Path(__file__).parent.parent.parent / "datasets" / "personas.json"
-with open(personas_file, "r") as f:
-    personas_data = json.load(f)
+with open(personas_file, "rb") as f:
+    personas_data = orjson.loads(f.read())
+
+# Serialized archetypes embedded in the system instruction
+ARCHETYPES_CONTEXT = json.dumps(personas_data["archetypes"], indent=2)
+
+# Static instructions and archetypes, sent as a stable system-instruction
+# prefix so each request only carries the user's input
+PERSONA_SYSTEM_INSTRUCTION = f"""You are an expert fitness persona designer. Create a unique, inspiring fitness identity for a user.
+
+EXISTING ARCHETYPES (for reference and inspiration):
+{ARCHETYPES_CONTEXT}
+
+TASK:
+1. Analyze the user's traits and goals
+2. Find the best matching archetype OR create a unique hybrid persona
+3. Generate a creative, empowering persona name (format: "The [Adjective] [Noun]")
+4. Create a memorable 3-word tagline (format: "Verb. Verb. Verb.")
+5. Choose a color palette (2 hex codes that match the persona's energy)
+6. Define workout approach and recovery priority
+7. Write a 2-3 sentence inspiring description
+8. Create a motivational quote that embodies this persona
+
+GUIDELINES:
+- Persona names should be inspiring and memorable
+- Taglines must be action-oriented and rhythmic
+- Color palettes should reflect the persona's energy (bold for intense, calm for gentle)
+- Keep descriptions concise but powerful
+- Ensure the persona feels authentic and aspirational
+
+Return ONLY valid JSON with this exact structure:
+{{
+  "persona_name": "The [Adjective] [Noun]",
+  "archetype_match": "name of closest archetype or null if unique",
+  "style": "description of training style",
+  "tagline": "Verb. Verb. Verb.",
+  "traits": ["trait1", "trait2", "trait3"],
+  "goals": ["goal1", "goal2"],
+  "color_palette": ["#HEX1", "#HEX2"],
+  "music_preference": "the user's music preference, unchanged",
+  "workout_approach": "approach_description",
+  "ideal_session_length": 45,
+  "recovery_priority": "low/medium/high",
+  "description": "2-3 sentence inspiring description of this persona",
+  "motivation_quote": "A powerful quote that embodies this persona's spirit"
+}}"""
+
+model = genai.GenerativeModel(config.GEMINI_MODEL, system_instruction=PERSONA_SYSTEM_INSTRUCTION)
+
+# Cache of generated personas keyed by a hash of the input
+persona_cache = TTLCache()
+persona_flight = SingleFlight()
 
 
 # Request Models
@@ -44,14 +96,14 @@ class PersonaInput(BaseModel):
     traits: List[str] = Field(
         ..., 
         description="User personality traits (e.g., disciplined, creative, spontaneous)",
-        min_items=1,
-        max_items=5
+        min_length=1,
+        max_length=5
     )
     goals: List[str] = Field(
         ...,
         description="Fitness goals (e.g., lean, strength, flexibility, endurance)",
-        min_items=1,
-        max_items=3
+        min_length=1,
+        max_length=3
     )
     music_preference: str = Field(
         ...,
@@ -72,7 +124,7 @@ class PersonaInput(BaseModel):
 class PersonaOutput(BaseModel):
     """Output model for generated persona."""
     persona_name: str
-    archetype_match: Optional[str] = None
+    archetype_match: Optional[str]
     style: str
     tagline: str
     traits: List[str]
@@ -86,94 +138,59 @@ class PersonaOutput(BaseModel):
     motivation_quote: str
 
 
-async def generate_persona(input_data: PersonaInput) -> PersonaOutput:
+# Constrain Gemini to JSON matching PersonaOutput
+PERSONA_GENERATION_CONFIG = genai.GenerationConfig(
+    response_mime_type="application/json",
+    response_schema=PersonaOutput
+)
+
+
+async def generate_persona(input_data: PersonaInput, use_cache: bool = True) -> PersonaOutput:
     """
     Generate a unique fitness persona using Gemini LLM.
     
     Args:
         input_data: User input containing traits, goals, and preferences
+        use_cache: Serve a cached persona for identical input if available
         
     Returns:
         PersonaOutput with generated persona details
     """
     
-    # Create context from existing archetypes
-    archetypes_context = json.dumps(personas_data["archetypes"], indent=2)
+    cache_key = hash_key(input_data.model_dump())
+    if use_cache:
+        cached = persona_cache.get(cache_key)
+        if cached is not None:
+            return cached
     
-    prompt = f"""You are an expert fitness persona designer. Create a unique, inspiring fitness identity for a user.
-
-EXISTING ARCHETYPES (for reference and inspiration):
-{archetypes_context}
-
-USER INPUT:
+    async def request_persona() -> PersonaOutput:
+        prompt = f"""USER INPUT:
 - Traits: {', '.join(input_data.traits)}
 - Goals: {', '.join(input_data.goals)}
 - Music Preference: {input_data.music_preference}
 - Workout Style: {input_data.workout_style or 'Not specified'}
-- Session Length Preference: {input_data.session_length_preference or 'Not specified'}
-
-TASK:
-1. Analyze the user's traits and goals
-2. Find the best matching archetype OR create a unique hybrid persona
-3. Generate a creative, empowering persona name (format: "The [Adjective] [Noun]")
-4. Create a memorable 3-word tagline (format: "Verb. Verb. Verb.")
-5. Choose a color palette (2 hex codes that match the persona's energy)
-6. Define workout approach and recovery priority
-7. Write a 2-3 sentence inspiring description
-8. Create a motivational quote that embodies this persona
-
-GUIDELINES:
-- Persona names should be inspiring and memorable
-- Taglines must be action-oriented and rhythmic
-- Color palettes should reflect the persona's energy (bold for intense, calm for gentle)
-- Keep descriptions concise but powerful
-- Ensure the persona feels authentic and aspirational
-
-Return ONLY valid JSON with this exact structure:
-{{
-  "persona_name": "The [Adjective] [Noun]",
-  "archetype_match": "name of closest archetype or null if unique",
-  "style": "description of training style",
-  "tagline": "Verb. Verb. Verb.",
-  "traits": ["trait1", "trait2", "trait3"],
-  "goals": ["goal1", "goal2"],
-  "color_palette": ["#HEX1", "#HEX2"],
-  "music_preference": "{input_data.music_preference}",
-  "workout_approach": "approach_description",
-  "ideal_session_length": 45,
-  "recovery_priority": "low/medium/high",
-  "description": "2-3 sentence inspiring description of this persona",
-  "motivation_quote": "A powerful quote that embodies this persona's spirit"
-}}"""
-
-    try:
-        response = model.generate_content(prompt)
-        response_text = response.text.strip()
-        
-        # Clean up response (remove markdown code blocks if present)
-        if response_text.startswith("```json"):
-            response_text = response_text[7:]
-        if response_text.startswith("```"):
-            response_text = response_text[3:]
-        if response_text.endswith("```"):
-            response_text = response_text[:-3]
-        response_text = response_text.strip()
+- Session Length Preference: {input_data.session_length_preference or 'Not specified'}"""
         
-        # Parse JSON response
-        persona_data = json.loads(response_text)
+        try:
+            response = await generate_content(
+                model,
+                prompt,
+                generation_config=PERSONA_GENERATION_CONFIG
+            )
         
-        return PersonaOutput(**persona_data)
+            # Response is schema-constrained JSON
+            persona = PersonaOutput.model_validate_json(response.text)
+            persona_cache.set(cache_key, persona)
+            return persona
         
-    except json.JSONDecodeError as e:
-        raise HTTPException(
-            status_code=500,
-            detail=f"Failed to parse AI response: {str(e)}"
-        )
-    except Exception as e:
-        raise HTTPException(
-            status_code=500,
-            detail=f"Error generating persona: {str(e)}"
-        )
+        except Exception as e:
+            raise HTTPException(
+                status_code=500,
+                detail=f"Error generating persona: {str(e)}"
+            )
+    
+    # Concurrent identical requests share one Gemini call
+    return await persona_flight.run(cache_key, request_persona)
 
 
 @app.get("/", response_class=HTMLResponse)
@@ -191,18 +208,20 @@ async def home(request: Request):
 @app.post("/generate", response_class=HTMLResponse)
 async def generate_persona_endpoint(
     request: Request,
+    background_tasks: BackgroundTasks,
     traits: str = Form(...),
     goals: str = Form(...),
     music_preference: str = Form(...),
     workout_style: Optional[str] = Form(None),
-    session_length_preference: Optional[str] = Form(None)
+    session_length_preference: Optional[str] = Form(None),
+    nocache: bool = False
 ):
     """Generate and display a fitness persona."""
     
     # Parse JSON strings from form
     try:
-        traits_list = json.loads(traits)
-        goals_list = json.loads(goals)
+        traits_list = orjson.loads(traits)
+        goals_list = orjson.loads(goals)
     except json.JSONDecodeError:
         raise HTTPException(
             status_code=400,
@@ -227,12 +246,11 @@ async def generate_persona_endpoint(
     )
     
     # Generate persona using Gemini
-    persona = await generate_persona(input_data)
+    persona = await generate_persona(input_data, use_cache=not nocache)
     
-    # Save to outputs (optional)
+    # Save to outputs (optional) after the response is sent
     output_file = Path(__file__).parent / "outputs" / "latest_persona.json"
-    with open(output_file, "w") as f:
-        json.dump(persona.dict(), f, indent=2)
+    background_tasks.add_task(write_json, output_file, persona.model_dump())
     
     # Render persona card
     return templates.TemplateResponse(
@@ -270,6 +288,14 @@ async def demo(request: Request):
     )
 
 
+@app.post("/api/batch")
+async def batch_generate(
+    inputs: Annotated[List[PersonaInput], Body(min_length=1, max_length=config.MAX_BATCH_SIZE)]
+):
+    """Generate several personas concurrently."""
+    return await gather_bounded(generate_persona, inputs)
+
+
 @app.get("/api/archetypes")
 async def get_archetypes():
     """Get all persona archetypes."""
@@ -9,37 +9,104 @@ Uses Gemini AI to intelligently split workouts based on:
 - Energy distribution
 """
 
+import itertools
 import os
-import sys
+import time
 from pathlib import Path
-from typing import List, Dict, Optional, Union
+from typing import List, Dict, Optional, Union, Annotated
 from datetime import datetime
-import json
+from types import MappingProxyType
+import orjson
 
-from fastapi import FastAPI, Request, HTTPException, Form
-from fastapi.responses import HTMLResponse
-from fastapi.templating import Jinja2Templates
+from fastapi import FastAPI, Request, HTTPException, Form, Body, BackgroundTasks
+from fastapi.responses import HTMLResponse, ORJSONResponse
 from fastapi.staticfiles import StaticFiles
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, TypeAdapter, model_validator
 import google.generativeai as genai
 from dotenv import load_dotenv
 
-# Add parent directory to path for shared modules
-sys.path.append(str(Path(__file__).parent.parent.parent))
 from shared.config import config
+from shared.batching import gather_bounded
+from shared.cache import TTLCache, hash_key
+from shared.throttling import generate_content
+from shared.templating import create_templates
+from shared.outputs import write_json
 
 # Load environment variables
 load_dotenv()
 
 # Configure Gemini
-genai.configure(api_key=config.GEMINI_API_KEY or os.getenv("GEMINI_API_KEY"))
+genai.configure(
+    api_key=config.GEMINI_API_KEY or os.getenv("GEMINI_API_KEY"),
+    transport=config.GEMINI_TRANSPORT
+)
 
-app = FastAPI(title="Micro-Workout Splitter", version="1.0.0")
-templates = Jinja2Templates(directory="templates")
+# Static role, rules and output format, sent as a stable system-instruction
+# prefix so each request only carries the workout and time blocks
+SPLIT_SYSTEM_INSTRUCTION = """You are an expert fitness coach helping someone with a fragmented schedule.
+
+**Your Task:**
+Intelligently split the user's workout into their available time blocks following these rules:
+
+1. **Prioritize high-priority exercises** - include them first
+2. **Group by movement patterns** - don't split similar exercises awkwardly
+3. **Maintain workout logic** - warm-up first, cool-down last when possible
+4. **Balance intensity** - don't cram all hard exercises in one block
+5. **Maximize coverage** - use as much of the available time as possible
+6. **Suggest timing** - indicate best time of day for each segment (e.g., "Morning - 7am", "Lunch break", "Evening")
+
+Return a JSON response with this structure:
+{
+  "segments": [
+    {
+      "block_number": 1,
+      "duration": <actual minutes used>,
+      "focus": "<primary focus like 'Lower body strength' or 'Mobility + Core'>",
+      "exercises": [
+        {
+          "name": "<exercise name>",
+          "duration": <minutes>,
+          "category": "<category>",
+          "priority": "<priority>",
+          "sets": <if applicable>,
+          "reps": "<if applicable>"
+        }
+      ],
+      "completion_time": "<suggested time like 'Morning - 7am' or 'Lunch break'>",
+      "rationale": "<brief explanation of why these exercises go together>"
+    }
+  ],
+  "coverage_percentage": <percentage of original workout covered>,
+  "ai_insights": "<2-3 sentence summary of the split strategy and any trade-offs made>"
+}
+
+Provide ONLY valid JSON, no additional text."""
+
+model = genai.GenerativeModel(config.GEMINI_MODEL, system_instruction=SPLIT_SYSTEM_INSTRUCTION)
+
+app = FastAPI(title="Micro-Workout Splitter", version="1.0.0", default_response_class=ORJSONResponse)
+templates = create_templates(Path(__file__).parent / "templates")
 
 # Load test data
-with open("test_data.json", "r") as f:
-    test_data = json.load(f)
+with open("test_data.json", "rb") as f:
+    test_data = orjson.loads(f.read())
+
+# Cache of AI splits keyed by a hash of (workout, blocks, scenario)
+split_cache = TTLCache()
+
+# Saved splits; the per-process sequence keeps same-nanosecond saves apart
+OUTPUTS_DIR = Path(__file__).parent / "outputs"
+_output_seq = itertools.count()
+
+
+# Color codes for workout categories (UI visualization)
+CATEGORY_COLORS = MappingProxyType({
+    "mobility": "#a8edea",
+    "strength": "#667eea",
+    "cardio": "#fa709a",
+    "core": "#43e97b"
+})
+DEFAULT_CATEGORY_COLOR = "#cccccc"
 
 
 # --- Pydantic Models ---
@@ -54,6 +121,13 @@ class Exercise(BaseModel):
     rest: Optional[Union[int, str]] = None  # Can be seconds or "as needed"
     duration_per_set: Optional[str] = None
     color: Optional[str] = None  # For UI visualization
+    
+    @model_validator(mode="after")
+    def assign_color(self):
+        """Color-code the exercise by category once, at construction."""
+        if self.color is None:
+            self.color = CATEGORY_COLORS.get(self.category.lower(), DEFAULT_CATEGORY_COLOR)
+        return self
 
 
 class Workout(BaseModel):
@@ -85,6 +159,42 @@ class SplitResponse(BaseModel):
     ai_insights: str
 
 
+# Response schema for Gemini: Optional and plain types only, no defaults
+
+class AIExercise(BaseModel):
+    name: str
+    duration: int
+    category: str
+    priority: str
+    sets: Optional[str]
+    reps: Optional[str]
+
+
+class AISegment(BaseModel):
+    block_number: int
+    duration: int
+    focus: str
+    exercises: List[AIExercise]
+    completion_time: str
+    rationale: str
+
+
+class SplitAIResult(BaseModel):
+    segments: List[AISegment]
+    coverage_percentage: float
+    ai_insights: str
+
+
+# Constrain Gemini to JSON matching SplitAIResult
+SPLIT_GENERATION_CONFIG = genai.GenerationConfig(
+    response_mime_type="application/json",
+    response_schema=SplitAIResult
+)
+
+# Validator for the segments list returned by Gemini
+SEGMENTS_ADAPTER = TypeAdapter(List[WorkoutSegment])
+
+
 # --- Helper Functions ---
 
 def build_split_prompt(workout: Workout, time_blocks: List[int], scenario: Optional[str]) -> str:
@@ -97,9 +207,7 @@ def build_split_prompt(workout: Workout, time_blocks: List[int], scenario: Optio
     
     scenario_context = f"Context: {scenario}\n" if scenario else ""
     
-    prompt = f"""You are an expert fitness coach helping someone with a fragmented schedule.
-
-{scenario_context}
+    prompt = f"""{scenario_context}
 **Full Workout to Split:**
 Name: {workout.name}
 Total Duration: {workout.total_duration} minutes
@@ -109,103 +217,82 @@ Total Duration: {workout.total_duration} minutes
 
 **Available Time Blocks:** {', '.join([f'{b} min' for b in time_blocks])}
 
-**Your Task:**
-Intelligently split this workout into the available time blocks following these rules:
-
-1. **Prioritize high-priority exercises** - include them first
-2. **Group by movement patterns** - don't split similar exercises awkwardly
-3. **Maintain workout logic** - warm-up first, cool-down last when possible
-4. **Balance intensity** - don't cram all hard exercises in one block
-5. **Maximize coverage** - use as much of the available time as possible
-6. **Suggest timing** - indicate best time of day for each segment (e.g., "Morning - 7am", "Lunch break", "Evening")
-
-Return a JSON response with this structure:
-{{
-  "segments": [
-    {{
-      "block_number": 1,
-      "duration": <actual minutes used>,
-      "focus": "<primary focus like 'Lower body strength' or 'Mobility + Core'>",
-      "exercises": [
-        {{
-          "name": "<exercise name>",
-          "duration": <minutes>,
-          "category": "<category>",
-          "priority": "<priority>",
-          "sets": <if applicable>,
-          "reps": "<if applicable>"
-        }}
-      ],
-      "completion_time": "<suggested time like 'Morning - 7am' or 'Lunch break'>",
-      "rationale": "<brief explanation of why these exercises go together>"
-    }}
-  ],
-  "coverage_percentage": <percentage of original workout covered>,
-  "ai_insights": "<2-3 sentence summary of the split strategy and any trade-offs made>"
-}}
-
-Provide ONLY valid JSON, no additional text."""
+Split this workout into the available time blocks."""
     
     return prompt
 
 
-async def split_workout_with_ai(workout: Workout, time_blocks: List[int], scenario: Optional[str]) -> SplitResponse:
+async def split_workout_with_ai(
+    workout: Workout,
+    time_blocks: List[int],
+    scenario: Optional[str],
+    use_cache: bool = True
+) -> SplitResponse:
     """Use Gemini to intelligently split the workout."""
     
+    cache_key = hash_key(workout.model_dump(), time_blocks, scenario)
+    if use_cache:
+        cached = split_cache.get(cache_key)
+        if cached is not None:
+            return cached
+    
     try:
-        model = genai.GenerativeModel('gemini-2.0-flash-exp')
-        
         prompt = build_split_prompt(workout, time_blocks, scenario)
         
-        response = model.generate_content(prompt)
-        result_text = response.text.strip()
-        
-        # Clean up markdown code blocks if present
-        if result_text.startswith("```json"):
-            result_text = result_text[7:]
-        if result_text.startswith("```"):
-            result_text = result_text[3:]
-        if result_text.endswith("```"):
-            result_text = result_text[:-3]
-        result_text = result_text.strip()
+        response = await generate_content(
+            model,
+            prompt,
+            generation_config=SPLIT_GENERATION_CONFIG
+        )
         
-        # Parse JSON response
-        result = json.loads(result_text)
+        # Parse schema-constrained JSON response
+        result = orjson.loads(response.text)
         
         # Convert to SplitResponse
-        segments = [
-            WorkoutSegment(
-                block_number=seg["block_number"],
-                duration=seg["duration"],
-                focus=seg["focus"],
-                exercises=[Exercise(**ex) for ex in seg["exercises"]],
-                completion_time=seg["completion_time"],
-                rationale=seg["rationale"]
-            )
-            for seg in result["segments"]
-        ]
+        # Validate every segment and its exercises in one pass
+        segments = SEGMENTS_ADAPTER.validate_python(result["segments"])
         
-        return SplitResponse(
+        split = SplitResponse(
             original_workout=workout.name,
             total_time=sum(block.duration for block in segments),
             segments=segments,
             coverage_percentage=result["coverage_percentage"],
             ai_insights=result["ai_insights"]
         )
+        split_cache.set(cache_key, split)
+        return split
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"AI processing error: {str(e)}")
 
 
-def get_category_color(category: str) -> str:
-    """Return color code for workout categories."""
-    colors = {
-        "mobility": "#a8edea",
-        "strength": "#667eea",
-        "cardio": "#fa709a",
-        "core": "#43e97b"
-    }
-    return colors.get(category.lower(), "#cccccc")
+async def split_request_with_ai(split_request: SplitRequest, use_cache: bool = True) -> SplitResponse:
+    """Validate a split request's time blocks and split it with Gemini."""
+    
+    if not split_request.available_blocks:
+        raise HTTPException(status_code=400, detail="Must provide at least one time block")
+    
+    return await split_workout_with_ai(
+        split_request.workout,
+        split_request.available_blocks,
+        split_request.scenario,
+        use_cache
+    )
+
+
+def write_split(path: Path, result: SplitResponse, created_ns: int) -> None:
+    """Write a split result with its creation timestamp."""
+    output_data = result.model_dump()
+    output_data["timestamp"] = datetime.fromtimestamp(created_ns / 1e9).isoformat()
+    write_json(path, output_data)
+
+
+def save_split(background_tasks: BackgroundTasks, result: SplitResponse) -> None:
+    """Schedule a split result to be saved under a unique filename."""
+    
+    created_ns = time.time_ns()
+    output_file = OUTPUTS_DIR / f"split_{created_ns}_{os.getpid()}_{next(_output_seq)}.json"
+    background_tasks.add_task(write_split, output_file, result, created_ns)
 
 
 # --- API Endpoints ---
@@ -226,12 +313,14 @@ async def home(request: Request):
 @app.post("/split", response_class=HTMLResponse)
 async def split_workout_form(
     request: Request,
+    background_tasks: BackgroundTasks,
     workout: int = Form(...),
     scenario: str = Form(""),
     block1: int = Form(None),
     block2: int = Form(None),
     block3: int = Form(None),
-    block4: int = Form(None)
+    block4: int = Form(None),
+    nocache: bool = False
 ):
     """Form submission endpoint to split a workout into micro-segments."""
     
@@ -258,21 +347,12 @@ async def split_workout_form(
     result = await split_workout_with_ai(
         split_request.workout,
         split_request.available_blocks,
-        split_request.scenario
+        split_request.scenario,
+        use_cache=not nocache
     )
     
-    # Add color coding for visualization
-    for segment in result.segments:
-        for exercise in segment.exercises:
-            exercise.color = get_category_color(exercise.category)
-    
-    # Save output
-    output_data = result.dict()
-    output_data["timestamp"] = datetime.now().isoformat()
-    
-    output_file = f"outputs/split_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
-    with open(output_file, "w") as f:
-        json.dump(output_data, f, indent=2)
+    # Save output after the response is sent
+    save_split(background_tasks, result)
     
     return templates.TemplateResponse(
         "workout_splitter.html",
@@ -285,25 +365,24 @@ async def split_workout_form(
 
 
 @app.post("/api/split")
-async def split_workout_api(split_request: SplitRequest):
+async def split_workout_api(split_request: SplitRequest, nocache: bool = False):
     """JSON API endpoint to split a workout into micro-segments."""
     
-    # Validate time blocks
-    if not split_request.available_blocks:
-        raise HTTPException(status_code=400, detail="Must provide at least one time block")
-    
-    # Call AI to split workout
-    result = await split_workout_with_ai(
-        split_request.workout,
-        split_request.available_blocks,
-        split_request.scenario
-    )
+    # Validate time blocks and call AI to split workout
+    return await split_request_with_ai(split_request, use_cache=not nocache)
+
+
+@app.post("/api/batch")
+async def split_workout_batch(
+    split_requests: Annotated[List[SplitRequest], Body(min_length=1, max_length=config.MAX_BATCH_SIZE)]
+):
+    """JSON API endpoint splitting several workouts concurrently."""
     
-    return result
+    return await gather_bounded(split_request_with_ai, split_requests)
 
 
 @app.get("/demo", response_class=HTMLResponse)
-async def demo(request: Request):
+async def demo(request: Request, background_tasks: BackgroundTasks):
     """Demo with pre-loaded data."""
     
     # Use first test workout and scenario
@@ -324,18 +403,8 @@ async def demo(request: Request):
         split_request.scenario
     )
     
-    # Add color coding for visualization
-    for segment in result.segments:
-        for exercise in segment.exercises:
-            exercise.color = get_category_color(exercise.category)
-    
-    # Save output
-    output_data = result.dict()
-    output_data["timestamp"] = datetime.now().isoformat()
-    
-    output_file = f"outputs/split_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
-    with open(output_file, "w") as f:
-        json.dump(output_data, f, indent=2)
+    # Save output after the response is sent
+    save_split(background_tasks, result)
     
     return templates.TemplateResponse(
         "workout_splitter.html",
@@ -0,0 +1,26 @@
+"""
+Gunicorn configuration for AI Fitness Disruption Lab experiments.
+Runs an experiment's FastAPI app on multiple Uvicorn worker processes.
+
+Usage (from an experiment directory):
+    gunicorn -c ../../gunicorn.conf.py main:app --bind 0.0.0.0:8001
+"""
+
+import multiprocessing
+import os
+
+# Default bind; override per experiment with --bind
+bind = os.getenv("BIND", "0.0.0.0:8000")
+
+# One worker per core plus headroom for workers waiting on Gemini
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1))
+
+# Uvicorn workers pick up uvloop and httptools when installed
+worker_class = "uvicorn.workers.UvicornWorker"
+
+# Import the app (datasets, templates, Gemini model) once and fork,
+# so workers share the loaded state copy-on-write
+preload_app = True
+
+# Gemini calls can take several seconds; leave room before recycling a worker
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
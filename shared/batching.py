@@ -0,0 +1,135 @@
+"""
+Concurrent batch helpers for AI Fitness Disruption Lab.
+Fans a list of inputs out to an async handler with bounded concurrency,
+and coalesces concurrent single calls into batched ones.
+"""
+
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Set, Tuple, TypeVar
+
+from fastapi import HTTPException
+
+from .config import config
+
+T = TypeVar("T")
+
+
+def _to_item(outcome: Any) -> Dict[str, Any]:
+    """Wrap a single gather outcome as a per-item batch result."""
+    if isinstance(outcome, HTTPException):
+        return {"status": "error", "detail": outcome.detail}
+    if isinstance(outcome, Exception):
+        return {"status": "error", "detail": str(outcome)}
+    return {"status": "success", "result": outcome}
+
+
+async def gather_bounded(
+    handler: Callable[[T], Awaitable[Any]],
+    items: Iterable[T],
+    limit: Optional[int] = None
+) -> List[Dict[str, Any]]:
+    """
+    Run handler over every item concurrently, at most limit at a time.
+    
+    A failing item is reported in its own slot instead of failing the batch.
+    
+    Args:
+        handler: Async function processing one item
+        items: Inputs to process
+        limit: Maximum in-flight handlers (defaults to config)
+    
+    Returns:
+        One {"status": "success", "result": ...} or
+        {"status": "error", "detail": ...} entry per item, in input order
+    """
+    semaphore = asyncio.Semaphore(limit or config.GEMINI_MAX_INFLIGHT)
+    
+    async def run(item: T) -> Any:
+        async with semaphore:
+            return await handler(item)
+    
+    outcomes = await asyncio.gather(*(run(item) for item in items), return_exceptions=True)
+    return [_to_item(outcome) for outcome in outcomes]
+
+
+class MicroBatcher:
+    """Collects calls arriving within a short window and handles them as one batch."""
+    
+    def __init__(
+        self,
+        handler: Callable[[List[Any]], Awaitable[List[Any]]],
+        max_batch: Optional[int] = None,
+        max_wait: Optional[float] = None
+    ):
+        """
+        Initialize an idle batcher.
+        
+        Args:
+            handler: Async function mapping a list of items to one result per
+                item, in order (an Exception in a slot fails only that item)
+            max_batch: Most items handled together (defaults to config)
+            max_wait: Seconds to wait for a batch to fill (defaults to config)
+        """
+        self.handler = handler
+        self.max_batch = max_batch or config.GEMINI_BATCH_MAX_SIZE
+        self.max_wait = max_wait if max_wait is not None else config.GEMINI_BATCH_WAIT
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: Set[asyncio.Task] = set()
+    
+    async def submit(self, item: Any) -> Any:
+        """
+        Queue item for the next batch and wait for its result.
+        
+        Args:
+            item: Input for the handler
+        
+        Returns:
+            The handler's result for this item (its exception is raised)
+        """
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # Queues and tasks are bound to one event loop
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._spawn(self._collect())
+        
+        future = loop.create_future()
+        self._queue.put_nowait((item, future))
+        return await future
+    
+    def _spawn(self, coro: Awaitable[Any]) -> None:
+        task = asyncio.ensure_future(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+    
+    async def _collect(self) -> None:
+        """Group queued items into batches and dispatch each without waiting on it."""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            self._spawn(self._dispatch(batch))
+    
+    async def _dispatch(self, batch: List[Tuple[Any, asyncio.Future]]) -> None:
+        """Run the handler on one batch and resolve each caller's future."""
+        try:
+            results = await self.handler([item for item, _ in batch])
+        except Exception as e:
+            results = [e] * len(batch)
+        
+        for (_, future), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
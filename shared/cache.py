@@ -0,0 +1,192 @@
+"""
+In-process response caching for AI Fitness Disruption Lab.
+Bounded LRU caches with per-entry expiry for LLM results.
+"""
+
+import asyncio
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Sequence
+
+import numpy as np
+
+from .config import config
+
+
+class TTLCache:
+    """Bounded LRU cache whose entries expire after a fixed TTL."""
+    
+    def __init__(self, maxsize: Optional[int] = None, ttl_seconds: Optional[float] = None):
+        """
+        Initialize an empty cache.
+        
+        Args:
+            maxsize: Maximum number of entries kept (defaults to config)
+            ttl_seconds: Seconds before an entry expires (defaults to config)
+        """
+        self.maxsize = maxsize if maxsize is not None else config.CACHE_MAX_ENTRIES
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else config.CACHE_TTL_SECONDS
+        self._entries: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+    
+    def get(self, key: Hashable) -> Optional[Any]:
+        """
+        Return the cached value for key, or None if missing or expired.
+        
+        Args:
+            key: Cache key
+        
+        Returns:
+            Cached value or None
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        
+        self._entries.move_to_end(key)
+        return value
+    
+    def set(self, key: Hashable, value: Any) -> None:
+        """
+        Store value under key, evicting the least recently used entry when full.
+        
+        Args:
+            key: Cache key
+            value: Value to cache
+        """
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+    
+    def clear(self) -> None:
+        """Remove all entries."""
+        self._entries.clear()
+    
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class NearestCache:
+    """Bounded cache serving values stored under nearby numeric feature vectors."""
+    
+    def __init__(
+        self,
+        tolerances: Sequence[float],
+        maxsize: Optional[int] = None,
+        ttl_seconds: Optional[float] = None
+    ):
+        """
+        Initialize an empty cache.
+        
+        Args:
+            tolerances: Largest difference per feature still treated as a match
+            maxsize: Maximum number of entries kept (defaults to config)
+            ttl_seconds: Seconds before an entry expires (defaults to config)
+        """
+        self.maxsize = maxsize if maxsize is not None else config.CACHE_MAX_ENTRIES
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else config.CACHE_TTL_SECONDS
+        
+        # Features are stored pre-divided by their tolerance, so a match is
+        # a Chebyshev distance of at most 1
+        self._scale = 1.0 / np.asarray(tolerances, dtype=np.float64)
+        self._vectors = np.zeros((self.maxsize, len(self._scale)))
+        self._expires = np.full(self.maxsize, -np.inf)
+        self._groups: List[Optional[Hashable]] = [None] * self.maxsize
+        self._values: List[Any] = [None] * self.maxsize
+        self._next = 0
+    
+    def get(self, group: Hashable, features: Sequence[float]) -> Optional[Any]:
+        """
+        Return the value of the nearest live entry in group within tolerance.
+        
+        Args:
+            group: Exact-match part of the key (categorical inputs)
+            features: Numeric part of the key
+        
+        Returns:
+            Cached value or None
+        """
+        live = self._expires >= time.monotonic()
+        live &= np.fromiter((g == group for g in self._groups), dtype=bool, count=self.maxsize)
+        if not live.any():
+            return None
+        
+        distance = np.abs(self._vectors - np.asarray(features) * self._scale).max(axis=1)
+        distance[~live] = np.inf
+        nearest = int(distance.argmin())
+        return self._values[nearest] if distance[nearest] <= 1.0 else None
+    
+    def set(self, group: Hashable, features: Sequence[float], value: Any) -> None:
+        """
+        Store value, overwriting the oldest entry when full.
+        
+        Args:
+            group: Exact-match part of the key (categorical inputs)
+            features: Numeric part of the key
+            value: Value to cache
+        """
+        slot = self._next
+        self._vectors[slot] = np.asarray(features) * self._scale
+        self._expires[slot] = time.monotonic() + self.ttl_seconds
+        self._groups[slot] = group
+        self._values[slot] = value
+        self._next = (slot + 1) % self.maxsize
+    
+    def clear(self) -> None:
+        """Remove all entries."""
+        self._expires.fill(-np.inf)
+        self._groups = [None] * self.maxsize
+        self._values = [None] * self.maxsize
+
+
+def hash_key(*parts: Any) -> str:
+    """
+    Build a stable cache key from JSON-serializable parts.
+    
+    Args:
+        *parts: Values identifying the cached computation
+    
+    Returns:
+        Hex digest of the canonical JSON encoding
+    """
+    payload = json.dumps(parts, sort_keys=True, default=str).encode()
+    return hashlib.blake2b(payload, digest_size=16).hexdigest()
+
+
+class SingleFlight:
+    """Coalesces concurrent calls for the same key into one in-flight task."""
+    
+    def __init__(self):
+        """Initialize with nothing in flight."""
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+    
+    async def run(self, key: Hashable, factory: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Await the in-flight call for key, starting it with factory if there is none.
+        
+        Args:
+            key: Identity of the call (usually the cache key)
+            factory: Zero-argument function returning the awaitable to run
+        
+        Returns:
+            Result of the shared call (its exception is raised to every caller)
+        """
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+        
+        # Shield so one caller disconnecting does not cancel the call for the rest
+        return await asyncio.shield(task)
+    
+    def _forget(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
@@ -25,6 +25,30 @@ class Config:
     GEMINI_MODEL = "gemini-2.0-flash-exp"
     GEMINI_TEMPERATURE = 0.7
     GEMINI_MAX_TOKENS = 2048
+    GEMINI_MAX_INFLIGHT = 8  # concurrent Gemini calls per process
+    GEMINI_RETRY_TIMEOUT = 30  # seconds spent retrying transient failures
+    GEMINI_TRANSPORT = "grpc_asyncio"  # one multiplexed channel per process for async calls
+    GEMINI_BATCH_MAX_SIZE = 8  # workout requests combined into one Gemini call
+    GEMINI_BATCH_WAIT = 0.025  # seconds to wait for a batch to fill
+    
+    # Batch endpoint settings
+    MAX_BATCH_SIZE = 20
+    
+    # Response cache settings
+    CACHE_MAX_ENTRIES = 256
+    CACHE_TTL_SECONDS = 3600
+    # Largest input differences still served a cached workout:
+    # (time available min, fatigue, stress, sleep hours)
+    WORKOUT_NEAR_TOLERANCES = (0.5, 0.5, 0.5, 0.5)
+    # Pre-generate common workouts at startup (one Gemini call batch per worker)
+    WORKOUT_WARMUP = os.getenv("WORKOUT_WARMUP", "false").lower() == "true"
+    
+    # HTTP cache lifetimes (seconds)
+    HEALTH_MAX_AGE = 30
+    DEMO_MAX_AGE = 300
+    
+    # Template settings (enable reload while editing templates)
+    TEMPLATE_AUTO_RELOAD = os.getenv("TEMPLATE_AUTO_RELOAD", "false").lower() == "true"
     
     # Safety settings
     MAX_WORKOUT_DURATION = 120  # minutes
@@ -0,0 +1,38 @@
+"""
+Vectorized workout statistics for AI Fitness Disruption Lab.
+Computes volume and progression stats over columnar workout history.
+"""
+
+import numpy as np
+from typing import Tuple
+
+
+def session_volumes(weights: np.ndarray, sets: np.ndarray, reps: np.ndarray) -> np.ndarray:
+    """
+    Compute training volume (sets x reps x weight) for every session.
+
+    Args:
+        weights: Weight used per session (kg)
+        sets: Number of sets per session
+        reps: Number of reps per session
+
+    Returns:
+        Array of per-session volumes (kg)
+    """
+    return sets * reps * weights
+
+
+def compute_stats(weights: np.ndarray, rpes: np.ndarray) -> Tuple[float, float]:
+    """
+    Compute summary progression stats with vectorized reductions.
+
+    Args:
+        weights: Weight used per session (kg)
+        rpes: Rate of Perceived Exertion per session
+
+    Returns:
+        Tuple of (avg_rpe, weight_delta)
+    """
+    avg_rpe = float(rpes.mean())
+    weight_delta = float(weights[-1] - weights[0])
+    return avg_rpe, weight_delta
@@ -3,10 +3,287 @@ Gemini LLM client for AI Fitness Disruption Lab.
 Handles all interactions with Google's Gemini API.
 """
 
+import asyncio
 import json
+import logging
+import math
+import re
+from contextlib import aclosing
+from pathlib import Path
 import google.generativeai as genai
-from typing import Dict, Any, Optional
+from jinja2 import Environment, FileSystemLoader
+from pydantic import TypeAdapter, ValidationError
+from typing import Dict, Any, List, NamedTuple, Optional, Union
+from typing_extensions import NotRequired, Required, TypedDict
 from .config import config
+from .cache import TTLCache, NearestCache, SingleFlight, hash_key
+from .batching import MicroBatcher, gather_bounded
+from .throttling import generate_content, stream_content
+
+logger = logging.getLogger(__name__)
+
+# JSON inside a markdown code block anywhere in the reply, else the outermost object/array
+_JSON_RE = re.compile(r'```(?:json)?\s*(.*?)\s*```|([\[{].*[\]}])', re.S)
+
+# Bucket widths for the structural workout cache
+TIME_BUCKET_MINUTES = 15
+SLEEP_BUCKET_HOURS = 1.0
+
+
+# Shape of the workout JSON Gemini is asked to return
+WORKOUT_JSON_EXAMPLE = r"""{
+  "workout": [
+    {"exercise": "Exercise Name", "sets": 3, "reps": "8-12", "rest": "60s", "notes": "Form cues"}
+  ],
+  "total_duration": <minutes, at most the time available>,
+  "intensity_level": "moderate",
+  "rationale": "Explanation of why this workout suits their current state"
+}"""
+
+# Role, rules and output format for workouts, sent as the workout model's
+# system instruction so each request only carries the user's profile
+WORKOUT_SYSTEM_INSTRUCTION = f"""You are an expert fitness coach creating a personalized workout.
+
+INSTRUCTIONS:
+1. Design a workout that adapts to their current state (fatigue, stress, sleep)
+2. Include 4-6 exercises appropriate for their fitness level
+3. Provide sets and reps for each exercise
+4. Include a brief rationale explaining why this workout suits their current condition
+5. Keep the total duration within the user's time available
+
+SAFETY RULES:
+- If fatigue > 7, reduce volume and intensity
+- If sleep < 5 hours, focus on mobility/light activity
+- If stress > 8, include calming elements
+- Never prescribe maximal loads or advanced techniques for beginners
+
+Return your response in this JSON format:
+{WORKOUT_JSON_EXAMPLE}
+"""
+
+
+# Per-request prompt templates, compiled once at import
+_prompt_env = Environment(
+    loader=FileSystemLoader(str(Path(__file__).parent / "prompts")),
+    trim_blocks=True,
+    lstrip_blocks=True,
+    keep_trailing_newline=True
+)
+USER_BLOCK_TEMPLATE = _prompt_env.get_template("workout_user.j2")
+
+# Prepended when several user profiles are sent in one call
+BATCH_INSTRUCTION = """Create one workout for EACH user profile below.
+Return a JSON array with one workout object (in the format above) per profile, in the same order.
+"""
+
+
+class WorkoutExercise(TypedDict, total=False):
+    """One exercise in a generated workout."""
+    exercise: Required[str]
+    sets: Union[int, str]
+    reps: Union[int, str]
+    rest: str
+    notes: str
+
+
+class WorkoutPlan(TypedDict):
+    """Workout returned by generate_workout (a plain dict at runtime)."""
+    workout: List[WorkoutExercise]
+    total_duration: int
+    intensity_level: str
+    rationale: str
+    fallback: NotRequired[bool]
+
+
+# Served when Gemini's reply cannot be parsed; shared read-only across fallbacks
+FALLBACK_EXERCISES: tuple[WorkoutExercise, ...] = (
+    {"exercise": "Bodyweight Squat", "sets": 3, "reps": "10-12", "rest": "60s", "notes": "Keep chest up"},
+    {"exercise": "Push-ups", "sets": 3, "reps": "8-10", "rest": "60s", "notes": "Modify on knees if needed"}
+)
+
+# Below these, the safety rules leave only light recovery work, so Gemini is skipped
+RECOVERY_SLEEP_HOURS = 3
+RECOVERY_FATIGUE = 9
+
+# Recovery blocks in priority order, each with the minutes it takes (20 in total)
+RECOVERY_EXERCISES: tuple[tuple[WorkoutExercise, int], ...] = (
+    ({"exercise": "Cat-Cow", "sets": 2, "reps": "10 slow reps", "rest": "30s", "notes": "Move with your breath"}, 3),
+    ({"exercise": "World's Greatest Stretch", "sets": 2, "reps": "5 per side", "rest": "30s", "notes": "Slow and controlled"}, 5),
+    ({"exercise": "Glute Bridge", "sets": 2, "reps": "12", "rest": "30s", "notes": "Bodyweight only, easy effort"}, 4),
+    ({"exercise": "90/90 Hip Switch", "sets": 2, "reps": "8 per side", "rest": "30s", "notes": "Stay tall through the spine"}, 4),
+    ({"exercise": "Box Breathing", "sets": 1, "reps": "4 minutes", "rest": "-", "notes": "Inhale 4s, hold 4s, exhale 4s, hold 4s"}, 4)
+)
+
+# Parse and validate Gemini's JSON in one pass
+WORKOUT_ADAPTER = TypeAdapter(WorkoutPlan)
+WORKOUT_BATCH_ADAPTER = TypeAdapter(List[WorkoutPlan])
+
+
+class WorkoutCacheKeys(NamedTuple):
+    """Keys under which one workout request is cached."""
+    prompt: str  # hash of the rendered prompt
+    structural: tuple  # bucketed input tuple
+    near: tuple  # (categorical group, numeric features)
+
+
+def _bucket(value: float, step: float) -> float:
+    """Floor value to a multiple of step (the prompt's sleep < 5h rule stays on a boundary)."""
+    return math.floor(value / step) * step
+
+
+def _user_block(
+    fitness_level: str,
+    goals: tuple[str, ...],
+    time_available: int,
+    equipment: tuple[str, ...],
+    fatigue: int,
+    stress: int,
+    sleep_hours: float
+) -> str:
+    """Render the per-request USER PROFILE prompt, with the safety rules that apply."""
+    return USER_BLOCK_TEMPLATE.render(
+        fitness_level=fitness_level,
+        goals=goals,
+        time_available=time_available,
+        equipment=equipment,
+        fatigue=fatigue,
+        stress=stress,
+        sleep_hours=sleep_hours
+    )
+
+
+def _extract_json(response_text: str) -> str:
+    """Return the JSON in a response, ignoring code fences and surrounding prose."""
+    # Fast path: a bare or fenced JSON value with nothing around it
+    text = response_text.strip().removeprefix("```json").removeprefix("```").removesuffix("```").strip()
+    if text[:1] in ("{", "[") and text[-1:] in ("}", "]"):
+        return text
+    
+    match = _JSON_RE.search(response_text)
+    if match is None:
+        raise json.JSONDecodeError("No JSON found in response", response_text, 0)
+    
+    return match.group(1) or match.group(2)
+
+
+class _JsonEndScanner:
+    """Tracks bracket depth across streamed chunks to find each top-level JSON value."""
+    
+    def __init__(self):
+        self.text = ""
+        self.depth = 0
+        self.start = 0
+        self.in_string = False
+        self.escaped = False
+    
+    def feed(self, text: str) -> List[str]:
+        """
+        Scan the next chunk of the reply.
+        
+        Args:
+            text: Newly received text
+        
+        Returns:
+            Every top-level {...} or [...] span that closed in this chunk
+        """
+        spans = []
+        offset = len(self.text)
+        self.text += text
+        for index, char in enumerate(text, offset):
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == "\\":
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+            elif char in "{[":
+                if self.depth == 0:
+                    self.start = index
+                self.depth += 1
+            elif self.depth == 0:
+                continue
+            elif char == '"':
+                self.in_string = True
+            elif char in "}]":
+                self.depth -= 1
+                if self.depth == 0:
+                    spans.append(self.text[self.start:index + 1])
+        return spans
+
+
+def _direct_response(time_available: int, fatigue: int, sleep_hours: float) -> Optional[WorkoutPlan]:
+    """
+    Return a fixed recovery workout when the safety rules leave nothing else to generate.
+    
+    Args:
+        time_available: Available workout time in minutes
+        fatigue: Fatigue level (1-10)
+        sleep_hours: Hours of sleep last night
+    
+    Returns:
+        Mobility/breathing workout, or None if Gemini should plan the session
+    """
+    if sleep_hours < RECOVERY_SLEEP_HOURS:
+        reason = f"only {sleep_hours} hours of sleep"
+    elif fatigue >= RECOVERY_FATIGUE:
+        reason = f"fatigue at {fatigue}/10"
+    else:
+        return None
+    
+    # Take blocks in priority order while they fit the time budget
+    workout = []
+    minutes = 0
+    for exercise, duration in RECOVERY_EXERCISES:
+        if minutes + duration <= time_available:
+            workout.append(exercise)
+            minutes += duration
+    if not workout:
+        exercise, minutes = RECOVERY_EXERCISES[0]
+        workout.append(exercise)
+    
+    return {
+        "workout": workout,
+        "total_duration": minutes,
+        "intensity_level": "light",
+        "rationale": f"With {reason}, today is for recovery: gentle mobility and breathing "
+                     "to restore movement without adding training stress."
+    }
+
+
+def _fit_to_time(workout_data: WorkoutPlan, time_available: int) -> WorkoutPlan:
+    """
+    Adapt a cached workout to a different time budget.
+    
+    Args:
+        workout_data: Workout generated for a nearby time budget
+        time_available: Minutes the user actually has
+    
+    Returns:
+        Copy of the workout trimmed (shorter budget) or with integer set counts
+        scaled up (longer budget) to the new duration
+    """
+    cached_duration = workout_data.get("total_duration")
+    if not isinstance(cached_duration, (int, float)) or cached_duration <= 0:
+        return workout_data
+    if cached_duration == time_available:
+        return workout_data
+    
+    ratio = time_available / cached_duration
+    workout = workout_data.get("workout", [])
+    if ratio < 1:
+        # One set of everything doesn't fit a shorter session; drop trailing exercises instead
+        keep = max(1, round(len(workout) * ratio))
+        return {**workout_data, "workout": workout[:keep], "total_duration": time_available}
+    
+    exercises = []
+    for exercise in workout:
+        sets = exercise.get("sets")
+        if isinstance(sets, int):
+            exercise = {**exercise, "sets": max(1, round(sets * ratio))}
+        exercises.append(exercise)
+    
+    return {**workout_data, "workout": exercises, "total_duration": time_available}
 
 
 class GeminiClient:
@@ -15,8 +292,22 @@ class GeminiClient:
     def __init__(self):
         """Initialize Gemini client with API key."""
         config.validate()
-        genai.configure(api_key=config.GEMINI_API_KEY)
+        genai.configure(api_key=config.GEMINI_API_KEY, transport=config.GEMINI_TRANSPORT)
         self.model = genai.GenerativeModel(config.GEMINI_MODEL)
+        self.workout_model = genai.GenerativeModel(
+            config.GEMINI_MODEL,
+            system_instruction=WORKOUT_SYSTEM_INSTRUCTION
+        )
+        
+        # Responses keyed by a hash of the rendered prompt; workouts are cached parsed
+        self._workout_cache = TTLCache()
+        self._text_cache = TTLCache()
+        self._structural_cache = TTLCache()
+        self._near_cache = NearestCache(config.WORKOUT_NEAR_TOLERANCES)
+        self._flight = SingleFlight()
+        
+        # Workout requests arriving together share one Gemini call
+        self._workout_batcher = MicroBatcher(self._generate_workouts)
     
     async def generate_workout(
         self,
@@ -28,7 +319,7 @@ class GeminiClient:
         stress: int,
         sleep_hours: float,
         exercises_data: Optional[Dict] = None
-    ) -> Dict[str, Any]:
+    ) -> WorkoutPlan:
         """
         Generate an adaptive workout based on user inputs.
         
@@ -43,75 +334,163 @@ class GeminiClient:
             exercises_data: Optional exercise database
             
         Returns:
-            Dictionary containing workout plan and rationale
+            Dictionary containing workout plan and rationale; "fallback" is True
+            when Gemini's reply could not be parsed
         """
         
-        prompt = f"""You are an expert fitness coach creating a personalized workout.
-
-USER PROFILE:
-- Fitness Level: {fitness_level}
-- Goals: {', '.join(goals)}
-- Time Available: {time_available} minutes
-- Equipment: {', '.join(equipment)}
-- Current Fatigue: {fatigue}/10
-- Current Stress: {stress}/10
-- Sleep Last Night: {sleep_hours} hours
-
-INSTRUCTIONS:
-1. Design a workout that adapts to their current state (fatigue, stress, sleep)
-2. Include 4-6 exercises appropriate for their fitness level
-3. Provide sets and reps for each exercise
-4. Include a brief rationale explaining why this workout suits their current condition
-5. Keep the total duration within {time_available} minutes
-
-SAFETY RULES:
-- If fatigue > 7, reduce volume and intensity
-- If sleep < 5 hours, focus on mobility/light activity
-- If stress > 8, include calming elements
-- Never prescribe maximal loads or advanced techniques for beginners
-
-Return your response in this JSON format:
-{{
-  "workout": [
-    {{"exercise": "Exercise Name", "sets": 3, "reps": "8-12", "rest": "60s", "notes": "Form cues"}},
-  ],
-  "total_duration": {time_available},
-  "intensity_level": "moderate",
-  "rationale": "Explanation of why this workout suits their current state"
-}}
-"""
+        # Order-free and deduplicated, so reordered lists share prompts and cache keys
+        goals = tuple(sorted(set(goals)))
+        equipment = tuple(sorted(set(equipment)))
+        
+        # Recovery days are fully determined by the safety rules
+        direct = _direct_response(time_available, fatigue, sleep_hours)
+        if direct is not None:
+            return direct
+        
+        prompt = _user_block(fitness_level, goals, time_available, equipment, fatigue, stress, sleep_hours)
         
+        keys = WorkoutCacheKeys(
+            prompt=hash_key("workout", prompt),
+            structural=(
+                fitness_level,
+                goals,
+                _bucket(time_available, TIME_BUCKET_MINUTES),
+                equipment,
+                fatigue,
+                stress,
+                _bucket(sleep_hours, SLEEP_BUCKET_HOURS)
+            ),
+            near=(
+                # The prompt's sleep < 5h rule is part of the group so tolerance never crosses it
+                (fitness_level, goals, equipment, sleep_hours < 5),
+                (time_available, fatigue, stress, sleep_hours)
+            )
+        )
+        
+        cached = self._workout_cache.get(keys.prompt)
+        if cached is not None:
+            return cached
+        
+        # Same profile within a time/sleep bucket: reuse a workout, rescaled to the time available
+        cached = self._structural_cache.get(keys.structural)
+        if cached is not None:
+            return _fit_to_time(cached, time_available)
+        
+        # Near-duplicate requests across a bucket edge (e.g. sleep 5.9 vs 6.1h)
+        cached = self._near_cache.get(*keys.near)
+        if cached is not None:
+            return cached
+        
+        # Concurrent identical prompts share one Gemini call
+        return await self._flight.run(
+            keys.prompt,
+            lambda: self._request_workout(prompt, keys, time_available)
+        )
+    
+    async def _request_workout(
+        self,
+        prompt: str,
+        keys: WorkoutCacheKeys,
+        time_available: int
+    ) -> WorkoutPlan:
+        """Generate a workout through the batcher and cache the parsed result."""
         try:
-            response = self.model.generate_content(prompt)
-            
-            # Extract JSON from response
-            response_text = response.text.strip()
-            
-            # Remove markdown code blocks if present
-            if response_text.startswith("```json"):
-                response_text = response_text[7:]
-            if response_text.startswith("```"):
-                response_text = response_text[3:]
-            if response_text.endswith("```"):
-                response_text = response_text[:-3]
-            
-            workout_data = json.loads(response_text.strip())
+            workout_data = await self._workout_batcher.submit(prompt)
+            self._cache_workout(keys, workout_data)
             return workout_data
             
-        except json.JSONDecodeError as e:
-            # Fallback response if JSON parsing fails
+        except (json.JSONDecodeError, ValidationError) as e:
+            # Fallback response if JSON parsing or validation fails
             return {
-                "workout": [
-                    {"exercise": "Bodyweight Squat", "sets": 3, "reps": "10-12", "rest": "60s", "notes": "Keep chest up"},
-                    {"exercise": "Push-ups", "sets": 3, "reps": "8-10", "rest": "60s", "notes": "Modify on knees if needed"}
-                ],
+                "workout": list(FALLBACK_EXERCISES),
                 "total_duration": time_available,
                 "intensity_level": "moderate",
-                "rationale": f"Adaptive workout generated (parsing error: {str(e)})"
+                "rationale": f"Adaptive workout generated (parsing error: {str(e)})",
+                "fallback": True
             }
         except Exception as e:
             raise Exception(f"Error generating workout: {str(e)}")
     
+    async def _generate_workouts(self, prompts: List[str]) -> List[Any]:
+        """
+        Generate workouts for several user blocks with a single Gemini call.
+        
+        Args:
+            prompts: USER PROFILE blocks
+        
+        Returns:
+            One parsed workout (or the exception raised for it) per prompt
+        """
+        if len(prompts) == 1:
+            return [await self._generate_one_workout(prompts[0])]
+        
+        profiles = "\n".join(f"PROFILE {i}:\n{prompt}" for i, prompt in enumerate(prompts, 1))
+        # API errors (quota, auth, bad requests) propagate to every waiting caller;
+        # retrying them one by one would only multiply the load
+        try:
+            workouts = await self._generate_json(f"{BATCH_INSTRUCTION}\n{profiles}", WORKOUT_BATCH_ADAPTER)
+        except (json.JSONDecodeError, ValidationError) as e:
+            logger.warning("Unparseable batch reply for %d workouts, retrying individually: %s", len(prompts), e)
+        else:
+            if len(workouts) == len(prompts):
+                return workouts
+            logger.warning("Batch reply had %d workouts for %d profiles, retrying individually", len(workouts), len(prompts))
+        
+        # Batch reply unusable: fall back to one call per request
+        return await asyncio.gather(
+            *(self._generate_one_workout(prompt) for prompt in prompts),
+            return_exceptions=True
+        )
+    
+    async def _generate_one_workout(self, prompt: str) -> WorkoutPlan:
+        """Generate and parse a single workout."""
+        return await self._generate_json(prompt, WORKOUT_ADAPTER)
+    
+    async def _generate_json(self, prompt: str, adapter: TypeAdapter) -> Any:
+        """
+        Stream a workout reply and parse it as soon as its JSON closes.
+        
+        Anything Gemini would send after the first valid value (a code fence,
+        trailing prose) is never read.
+        
+        Args:
+            prompt: Prompt for the workout model
+            adapter: Type the reply is validated against
+        
+        Returns:
+            Parsed and validated reply
+        """
+        scanner = _JsonEndScanner()
+        async with aclosing(stream_content(self.workout_model, prompt)) as stream:
+            async for text in stream:
+                for candidate in scanner.feed(text):
+                    # Braces in leading prose ("{your} plan") close early; keep reading past them
+                    try:
+                        return adapter.validate_json(candidate)
+                    except ValidationError:
+                        pass
+        
+        return adapter.validate_json(_extract_json(scanner.text))
+    
+    async def warmup(self, common_params: List[Dict[str, Any]]) -> int:
+        """
+        Generate workouts for common inputs so matching requests hit the cache.
+        
+        Args:
+            common_params: generate_workout keyword arguments, one dict per workout
+        
+        Returns:
+            Number of workouts generated without error
+        """
+        results = await gather_bounded(lambda params: self.generate_workout(**params), common_params)
+        return sum(result["status"] == "success" for result in results)
+    
+    def _cache_workout(self, keys: WorkoutCacheKeys, workout_data: WorkoutPlan) -> None:
+        """Store a parsed workout under each of its cache keys."""
+        self._workout_cache.set(keys.prompt, workout_data)
+        self._structural_cache.set(keys.structural, workout_data)
+        self._near_cache.set(*keys.near, workout_data)
+    
     async def generate_text(self, prompt: str) -> str:
         """
         Generate text response from Gemini.
@@ -122,12 +501,35 @@ Return your response in this JSON format:
         Returns:
             Generated text response
         """
+        cache_key = hash_key("text", prompt)
+        cached = self._text_cache.get(cache_key)
+        if cached is not None:
+            return cached
+        
+        return await self._flight.run(cache_key, lambda: self._request_text(prompt, cache_key))
+    
+    async def _request_text(self, prompt: str, cache_key: str) -> str:
+        """Call Gemini for a text prompt and cache the response."""
         try:
-            response = self.model.generate_content(prompt)
+            response = await generate_content(self.model, prompt)
+            self._text_cache.set(cache_key, response.text)
             return response.text
         except Exception as e:
             raise Exception(f"Error generating text: {str(e)}")
 
 
-# Create singleton instance
-gemini_client = GeminiClient()
+# Created on first use, so importing this module never configures the SDK
+_client: Optional[GeminiClient] = None
+
+
+def get_gemini_client() -> GeminiClient:
+    """
+    Return the process-wide GeminiClient, creating it on first call.
+    
+    Returns:
+        Shared GeminiClient instance
+    """
+    global _client
+    if _client is None:
+        _client = GeminiClient()
+    return _client
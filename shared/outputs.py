@@ -0,0 +1,24 @@
+"""
+Output persistence for AI Fitness Disruption Lab.
+Saves experiment results to disk outside the request path.
+"""
+
+import orjson
+from pathlib import Path
+from typing import Any, Union
+
+
+def write_json(path: Union[str, Path], data: Any) -> None:
+    """
+    Write data as indented JSON, creating the parent directory if needed.
+    
+    Scheduled as a FastAPI background task so the response is sent first
+    and the blocking write runs in the threadpool.
+    
+    Args:
+        path: Destination file
+        data: JSON-serializable payload
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(orjson.dumps(data, option=orjson.OPT_INDENT_2))
@@ -0,0 +1,51 @@
+"""
+HTTP response helpers for AI Fitness Disruption Lab.
+Conditional (ETag) responses for static or cached payloads.
+"""
+
+import hashlib
+from typing import Optional
+from fastapi import Request, Response
+
+
+def make_etag(body: bytes) -> str:
+    """Return a strong ETag for a response body."""
+    return f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    """Weak comparison of an If-None-Match header against an ETag."""
+    if if_none_match.strip() == "*":
+        return True
+    candidates = (tag.strip().removeprefix("W/") for tag in if_none_match.split(","))
+    return etag in candidates
+
+
+def conditional_response(
+    request: Request,
+    body: bytes,
+    media_type: str,
+    max_age: int,
+    etag: Optional[str] = None
+) -> Response:
+    """
+    Build a cacheable response, answering 304 when the client copy is current.
+    
+    Args:
+        request: Incoming request (for If-None-Match)
+        body: Encoded response body
+        media_type: Response content type
+        max_age: Seconds clients and proxies may reuse the response
+        etag: Precomputed ETag for body, if available
+        
+    Returns:
+        200 response with body, or 304 with validators only
+    """
+    etag = etag or make_etag(body)
+    headers = {"ETag": etag, "Cache-Control": f"public, max-age={max_age}"}
+    
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and _etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    
+    return Response(content=body, media_type=media_type, headers=headers)
@@ -0,0 +1,87 @@
+"""
+Template rendering setup for AI Fitness Disruption Lab.
+Builds Jinja2 environments with bytecode caching and preloaded templates.
+"""
+
+import logging
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, Union
+
+from fastapi.responses import StreamingResponse
+from fastapi.templating import Jinja2Templates
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
+
+from .config import config
+
+# Number of rendered fragments flushed to the socket at a time
+STREAM_BUFFER_SIZE = 32
+
+# Appended when a template fails after its response has started streaming
+RENDER_ERROR_HTML = '<p role="alert">Something went wrong while loading this page. Please try again.</p>'
+
+logger = logging.getLogger(__name__)
+
+# Compiled template bytecode shared by every experiment in this process tree
+_bytecode_cache = FileSystemBytecodeCache()
+
+
+def create_templates(directory: Union[str, Path]) -> Jinja2Templates:
+    """
+    Create a Jinja2Templates instance with every template precompiled.
+    
+    Args:
+        directory: Directory containing the experiment's templates
+    
+    Returns:
+        Jinja2Templates backed by a cached environment
+    """
+    env = Environment(
+        loader=FileSystemLoader(str(directory)),
+        autoescape=True,
+        auto_reload=config.TEMPLATE_AUTO_RELOAD,
+        cache_size=400,
+        bytecode_cache=_bytecode_cache
+    )
+    
+    # Compile templates up front so the first render skips parsing
+    for name in env.list_templates():
+        env.get_template(name)
+    
+    return Jinja2Templates(env=env)
+
+
+def stream_template(
+    templates: Jinja2Templates,
+    name: str,
+    context: Dict[str, Any]
+) -> StreamingResponse:
+    """
+    Render a template incrementally into a streaming HTML response.
+    
+    The first buffered chunk is rendered before the response is returned, so
+    errors there still raise in the caller. Later errors can't change the
+    status that was already sent; they are logged and the page ends with a notice.
+    
+    Args:
+        templates: Templates created by create_templates
+        name: Template file name
+        context: Template context (including "request")
+    
+    Returns:
+        StreamingResponse that flushes HTML as it renders
+    """
+    stream = templates.get_template(name).stream(context)
+    stream.enable_buffering(STREAM_BUFFER_SIZE)
+    first = next(stream, "")
+    
+    async def render() -> AsyncIterator[str]:
+        # Async generator so Starlette iterates on the event loop, not a thread pool
+        yield first
+        try:
+            for chunk in stream:
+                yield chunk
+        except Exception:
+            logger.exception("Failed to render %s after the response started", name)
+            yield RENDER_ERROR_HTML
+    
+    return StreamingResponse(render(), media_type="text/html")
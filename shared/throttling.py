@@ -0,0 +1,66 @@
+"""
+Gemini call throttling for AI Fitness Disruption Lab.
+Caps in-flight Gemini requests per process and retries transient failures.
+"""
+
+import asyncio
+from contextlib import aclosing
+from typing import Any, AsyncIterator
+
+import google.generativeai as genai
+from google.api_core.exceptions import DeadlineExceeded, ResourceExhausted, ServiceUnavailable
+from google.api_core.retry import AsyncRetry, if_exception_type
+
+from .config import config
+
+# Process-wide cap on concurrent Gemini requests
+_gemini_slots = asyncio.Semaphore(config.GEMINI_MAX_INFLIGHT)
+
+# Jittered exponential backoff on 429 (quota), 503 and deadline errors;
+# request errors such as InvalidArgument are never retried
+_retry_transient = AsyncRetry(
+    predicate=if_exception_type(ResourceExhausted, ServiceUnavailable, DeadlineExceeded),
+    initial=1.0,
+    maximum=10.0,
+    multiplier=2.0,
+    timeout=config.GEMINI_RETRY_TIMEOUT
+)
+
+
+async def generate_content(model: genai.GenerativeModel, prompt: Any, **kwargs: Any) -> Any:
+    """
+    Call model.generate_content_async within the concurrency cap, retrying transient errors.
+    
+    Args:
+        model: Gemini model to call
+        prompt: Prompt contents
+        **kwargs: Extra generate_content_async arguments (generation_config, ...)
+    
+    Returns:
+        The Gemini response; use stream_content for streamed replies
+    """
+    async with _gemini_slots:
+        return await _retry_transient(model.generate_content_async)(prompt, **kwargs)
+
+
+async def stream_content(model: genai.GenerativeModel, prompt: Any, **kwargs: Any) -> AsyncIterator[str]:
+    """
+    Stream a Gemini reply, holding a concurrency slot until the stream is drained or closed.
+    
+    Callers that stop early should close the generator (e.g. with
+    contextlib.aclosing) so the slot and the Gemini stream are released
+    right away rather than at garbage collection.
+    
+    Args:
+        model: Gemini model to call
+        prompt: Prompt contents
+        **kwargs: Extra generate_content_async arguments (generation_config, ...)
+    
+    Yields:
+        Text of each streamed chunk
+    """
+    async with _gemini_slots:
+        response = await _retry_transient(model.generate_content_async)(prompt, stream=True, **kwargs)
+        async with aclosing(aiter(response)) as chunks:
+            async for chunk in chunks:
+                yield chunk.text
@@ -0,0 +1,16 @@
+"""
+Input validation helpers for AI Fitness Disruption Lab.
+Shared Pydantic annotations for experiment request schemas.
+"""
+
+from typing import Any
+from pydantic import BeforeValidator
+
+
+def to_lowercase(v: Any) -> Any:
+    """Normalize string choices to lowercase before Literal validation."""
+    return v.lower() if isinstance(v, str) else v
+
+
+# Annotated metadata that makes a Literal choice case-insensitive
+CaseInsensitive = BeforeValidator(to_lowercase)